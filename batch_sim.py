@@ -0,0 +1,356 @@
+# Vectorized Battlesnake simulator that advances many independent boards at once.
+#
+# Every board of the batch is held in NumPy arrays indexed by [board, snake, ...]:
+# bodies as flat cells (y * width + x) with the head first, lengths, health, food
+# as a mask of cells. A step moves, feeds and eliminates every snake of every
+# board with array operations, following the standard and solo rules of rules.py
+# (without hazards). Boards start the way rules.Game starts them.
+#
+# Policies score the four moves of every snake of every board in one call and
+# return an array shaped (boards, snakes, 4), the simulator plays the best scored
+# move. Running the script plays self-play games and adds their examples to the
+# training dataset, labelled the way parseGameData.py labels saved games.
+
+import argparse
+import time
+import typing
+
+import numpy as np
+
+from rules import DEFAULT_SETTINGS, Game
+from snakeSupervision.dataset import SHARD_SIZE, ShardWriter
+from snakeSupervision.encoder import ACTION_CHANNEL, CHANNELS, INPUT_SIZE, add_symmetries
+
+# Move order of the last axis of moves and scores, the same as encoder.ACTION_INDEX
+MOVES = ('up', 'down', 'left', 'right')
+MOVE_DX = np.array([0, 0, -1, 1])
+MOVE_DY = np.array([1, -1, 0, 0])
+SNAKE_MAX_HEALTH = 100
+GAME_MODES = ('standard', 'solo')
+
+
+class BatchSimulator:
+    def __init__(self, boards: int, snakes: int, width: int = 11, height: int = 11,
+                 game_mode: str = 'standard', seed: typing.Optional[int] = None,
+                 settings: typing.Optional[typing.Dict] = None, max_turns: typing.Optional[int] = None):
+        if game_mode not in GAME_MODES:
+            raise Exception(f"Unknown game mode {game_mode}, expected one of {GAME_MODES}")
+        self.boards = boards
+        self.snakes = snakes
+        self.width = width
+        self.height = height
+        self.cells = width * height
+        self.game_mode = game_mode
+        self.settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        self.max_turns = max_turns
+        self.rng = np.random.default_rng(seed)
+        # A snake can't be longer than the board, plus its tail stacked after eating
+        self.bodies = np.zeros((boards, snakes, self.cells + 1), dtype=np.int32)
+        self.lengths = np.zeros((boards, snakes), dtype=np.int32)
+        self.health = np.zeros((boards, snakes), dtype=np.int32)
+        self.alive = np.zeros((boards, snakes), dtype=bool)
+        self.food = np.zeros((boards, self.cells), dtype=bool)
+        self.turn = np.zeros(boards, dtype=np.int32)
+        self.done = np.zeros(boards, dtype=bool)
+        self.reset()
+
+    # Start new games on the boards in mask, every board by default
+    def reset(self, mask: typing.Optional[np.ndarray] = None):
+        boards = np.arange(self.boards) if mask is None else np.flatnonzero(mask)
+        for board in boards:
+            game = Game([('', {})] * self.snakes, self.game_mode, self.width, self.height,
+                        int(self.rng.integers(2 ** 63)), settings=self.settings)
+            for i, snake in enumerate(game.snakes):
+                self.bodies[board, i, :len(snake.body)] = [y * self.width + x for x, y in snake.body]
+                self.lengths[board, i] = len(snake.body)
+            self.food[board] = False
+            self.food[board, [y * self.width + x for x, y in game.food]] = True
+        self.health[boards] = SNAKE_MAX_HEALTH
+        self.alive[boards] = True
+        self.turn[boards] = 0
+        self.done[boards] = False
+
+    def heads(self) -> np.ndarray:
+        return self.bodies[:, :, 0]
+
+    # Given moves shaped (boards, snakes), return each snake's next head cell and
+    # whether it is on the board
+    def next_heads(self, moves: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+        heads = self.heads()
+        x = heads % self.width + MOVE_DX[moves]
+        y = heads // self.width + MOVE_DY[moves]
+        on_board = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        return np.where(on_board, y * self.width + x, 0), on_board
+
+    # Count the body parts of the snakes in mask on every cell, from part first up to but
+    # not including part length + last of each snake, shaped (boards, cells)
+    def count_parts(self, mask: np.ndarray, first: int = 0, last: int = 0) -> np.ndarray:
+        parts = np.arange(self.lengths.max() + 1)
+        in_body = mask[:, :, np.newaxis] & (parts >= first) & (parts < (self.lengths + last)[:, :, np.newaxis])
+        cells = self.bodies[:, :, :len(parts)] + (np.arange(self.boards) * self.cells)[:, np.newaxis, np.newaxis]
+        return np.bincount(cells[in_body], minlength=self.boards * self.cells).reshape(self.boards, self.cells)
+
+    # Play one turn on every board that isn't done, with moves shaped (boards, snakes)
+    # holding indexes into MOVES. Return the boards whose game ended this turn
+    def step(self, moves: np.ndarray) -> np.ndarray:
+        playing = ~self.done
+        active = self.alive & playing[:, np.newaxis]
+        board_index = np.arange(self.boards)[:, np.newaxis]
+
+        # Move, shifting every body one part back
+        new_heads, on_board = self.next_heads(moves)
+        longest = self.lengths.max()
+        self.bodies[:, :, 1:longest + 1] = self.bodies[:, :, :longest]
+        self.bodies[:, :, 0] = new_heads
+        self.health -= active
+
+        # Feed, growing by a copy of the tail after the move
+        eaten = active & on_board & self.food[board_index, new_heads]
+        eaten_boards, eaten_snakes = np.nonzero(eaten)
+        tails = self.lengths[eaten]
+        self.bodies[eaten_boards, eaten_snakes, tails] = self.bodies[eaten_boards, eaten_snakes, tails - 1]
+        self.health[eaten] = SNAKE_MAX_HEALTH
+        self.lengths += eaten
+        self.food[eaten_boards, new_heads[eaten]] = False
+
+        # Eliminate snakes out of health or off the board, then collisions between the rest
+        eliminated = active & ((self.health <= 0) | ~on_board)
+        remaining = active & ~eliminated
+        bodies = self.count_parts(remaining, first=1)
+        collided = remaining & (bodies[board_index, new_heads] > 0)
+        for i in range(self.snakes):
+            for j in range(self.snakes):
+                if i != j:
+                    collided[:, i] |= (
+                        remaining[:, i] & remaining[:, j] & (new_heads[:, i] == new_heads[:, j])
+                        & (self.lengths[:, i] <= self.lengths[:, j])
+                    )
+        self.alive &= ~(eliminated | collided)
+
+        self.turn += playing
+        self._spawn_food(playing)
+        if self.game_mode == 'solo':
+            ended = playing & (self.alive.sum(axis=1) == 0)
+        else:
+            ended = playing & (self.alive.sum(axis=1) <= 1)
+        if self.max_turns is not None:
+            ended |= playing & (self.turn >= self.max_turns)
+        self.done |= ended
+        return ended
+
+    # Spawn food like rules.Game on the boards in mask
+    def _spawn_food(self, mask: np.ndarray):
+        missing = np.maximum(self.settings['minimumFood'] - self.food.sum(axis=1), 0)
+        chance = self.rng.random(self.boards) * 100 < self.settings['foodSpawnChance']
+        missing[mask & (missing == 0) & chance] = 1
+        missing[~mask] = 0
+        occupied = self.count_parts(self.alive) > 0
+        while missing.any():
+            spawn = np.flatnonzero(missing > 0)
+            # The free cell with the highest random score of each board
+            scores = self.rng.random((len(spawn), self.cells))
+            scores[occupied[spawn] | self.food[spawn]] = -1
+            cells = scores.argmax(axis=1)
+            has_room = scores[np.arange(len(spawn)), cells] >= 0
+            self.food[spawn[has_room], cells[has_room]] = True
+            missing[spawn] -= 1
+            missing[spawn[~has_room]] = 0
+
+    # Return the index of the winner of every board, -1 if there is none
+    def winners(self) -> np.ndarray:
+        return np.where(self.alive.sum(axis=1) == 1, self.alive.argmax(axis=1), -1)
+
+    # Play the best scored move of every snake, breaking ties at random
+    def choose_moves(self, scores: np.ndarray) -> np.ndarray:
+        return (scores + self.rng.random(scores.shape) * 1e-6).argmax(axis=2)
+
+
+# Given boards shaped like BatchSimulator's arrays, the subject snake of each board and
+# its action (-1 for none), return the network inputs the way encoder.encode_example makes them
+def encode_boards(width: int, height: int, bodies: np.ndarray, lengths: np.ndarray, alive: np.ndarray,
+                  food: np.ndarray, subject: np.ndarray, actions: np.ndarray) -> np.ndarray:
+    count, snakes = lengths.shape
+    rows = np.arange(count)
+    encoded = np.zeros((count, INPUT_SIZE[0], INPUT_SIZE[1], CHANNELS), dtype=np.uint8)
+    # Crop boards larger than the input to a window around the subject's head
+    head = bodies[rows, subject, 0]
+    offset_x = np.clip(head % width - INPUT_SIZE[0] // 2, 0, max(width - INPUT_SIZE[0], 0))
+    offset_y = np.clip(head // width - INPUT_SIZE[1] // 2, 0, max(height - INPUT_SIZE[1], 0))
+
+    parts = np.arange(lengths.max())
+    in_body = alive[:, :, np.newaxis] & (parts < lengths[:, :, np.newaxis])
+    is_subject = (np.arange(snakes) == subject[:, np.newaxis])[:, :, np.newaxis]
+    channels = np.where(is_subject, 0, 2) + (parts > 0)
+    channels = np.broadcast_to(channels, in_body.shape)
+    cells = bodies[:, :, :len(parts)]
+    board, _, _ = np.nonzero(in_body)
+    food_board, food_cells = np.nonzero(food)
+    board = np.concatenate([board, food_board])
+    cells = np.concatenate([cells[in_body], food_cells])
+    channels = np.concatenate([channels[in_body], np.full(len(food_cells), 4)])
+
+    x = cells % width - offset_x[board]
+    y = cells // width - offset_y[board]
+    inside = (x >= 0) & (x < INPUT_SIZE[0]) & (y >= 0) & (y < INPUT_SIZE[1])
+    encoded[board[inside], x[inside], y[inside], channels[inside]] = 1
+    marked = actions >= 0
+    encoded[rows[marked], 0, actions[marked], ACTION_CHANNEL] = 1
+    return encoded
+
+
+# Score -1 for every move off the board
+def wall_scores(sim: BatchSimulator) -> np.ndarray:
+    scores = np.zeros((sim.boards, sim.snakes, len(MOVES)))
+    for move in range(len(MOVES)):
+        _, on_board = sim.next_heads(np.full((sim.boards, sim.snakes), move))
+        scores[:, :, move] -= ~on_board
+    return scores
+
+
+# Score -1 for every move onto a body part that is still there next turn
+def body_scores(sim: BatchSimulator) -> np.ndarray:
+    bodies = sim.count_parts(sim.alive, last=-1)
+    board_index = np.arange(sim.boards)[:, np.newaxis]
+    scores = np.zeros((sim.boards, sim.snakes, len(MOVES)))
+    for move in range(len(MOVES)):
+        cells, on_board = sim.next_heads(np.full((sim.boards, sim.snakes), move))
+        scores[:, :, move] -= on_board & (bodies[board_index, cells] > 0)
+    return scores
+
+
+# The moves of main.py: random among the moves that avoid walls and bodies
+def safe_policy(sim: BatchSimulator) -> np.ndarray:
+    return wall_scores(sim) + body_scores(sim)
+
+
+# The moves of sl_snake.py: the safe move with the highest predicted chance of winning
+def predictor_policy(predictor) -> typing.Callable[[BatchSimulator], np.ndarray]:
+    def policy(sim: BatchSimulator) -> np.ndarray:
+        # Predictions are between 0 and 1, so any safer move scores higher
+        scores = safe_policy(sim) * 2
+        # Every live snake of every playing board, scored in one call
+        boards, snakes = np.nonzero(sim.alive & ~sim.done[:, np.newaxis])
+        if len(boards) == 0:
+            return scores
+        count = len(boards) * len(MOVES)
+        nn_inputs = encode_boards(
+            sim.width, sim.height, np.repeat(sim.bodies[boards], len(MOVES), axis=0),
+            np.repeat(sim.lengths[boards], len(MOVES), axis=0), np.repeat(sim.alive[boards], len(MOVES), axis=0),
+            np.repeat(sim.food[boards], len(MOVES), axis=0), np.repeat(snakes, len(MOVES)),
+            np.tile(np.arange(len(MOVES)), len(boards))
+        )
+        predictions = predictor.predict_inputs(nn_inputs.astype(np.float32))
+        scores[boards, snakes] += predictions.reshape(len(boards), len(MOVES))
+        return scores
+    return policy
+
+
+# Keeps the turns of every board's game, and when a game ends writes its last tenth
+# as training examples, one for each snake that survived the turn's move, like parseGameData.py
+class ExampleRecorder:
+    def __init__(self, sim: BatchSimulator, writer: ShardWriter, augment: bool = False):
+        self.sim = sim
+        self.writer = writer
+        self.augment = augment
+        # Indexed as turns[board] = [(bodies, lengths, alive, food, moves, survivors), ...]
+        self.turns = [[] for _ in range(sim.boards)]
+        self.examples = 0
+
+    # Play one turn of sim with moves, recording the state every playing board had before it
+    def step(self, moves: np.ndarray) -> np.ndarray:
+        sim = self.sim
+        playing = np.flatnonzero(~sim.done)
+        longest = sim.lengths.max()
+        before = (
+            sim.bodies[playing, :, :longest].copy(), sim.lengths[playing].copy(),
+            sim.alive[playing].copy(), sim.food[playing].copy(), moves[playing],
+        )
+        ended = sim.step(moves)
+        for i, board in enumerate(playing):
+            self.turns[board].append(tuple(values[i] for values in before) + (sim.alive[board].copy(),))
+        winners = sim.winners()
+        for board in np.flatnonzero(ended):
+            self._write(self.turns[board], winners[board])
+            self.turns[board] = []
+        return ended
+
+    def _write(self, turns: typing.List[typing.Tuple], winner: int):
+        turns = turns[len(turns) - len(turns) // 10:]
+        samples = [(turn, snake) for turn in turns for snake in np.flatnonzero(turn[5])]
+        if len(samples) == 0:
+            return
+        longest = max(turn[0].shape[1] for turn, _ in samples)
+        bodies = np.zeros((len(samples), self.sim.snakes, longest), dtype=np.int32)
+        for i, (turn, _) in enumerate(samples):
+            bodies[i, :, :turn[0].shape[1]] = turn[0]
+        subject = np.array([snake for _, snake in samples])
+        examples = encode_boards(
+            self.sim.width, self.sim.height, bodies,
+            np.stack([turn[1] for turn, _ in samples]), np.stack([turn[2] for turn, _ in samples]),
+            np.stack([turn[3] for turn, _ in samples]), subject,
+            np.array([turn[4][snake] for turn, snake in samples]),
+        )
+        labels = (subject == winner).astype(np.uint8)
+        if self.augment:
+            examples, labels = add_symmetries(examples, labels, self.sim.width, self.sim.height)
+        self.writer.add(examples, labels, (self.sim.width, self.sim.height))
+        self.examples += len(examples)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--boards', default=256, type=int,
+                        help='Boards simulated at once. Default 256.')
+    parser.add_argument('-n', '--games', default=1000, type=int,
+                        help='Number of games to play. Default 1000.')
+    parser.add_argument('-s', '--snakes', default=4, type=int,
+                        help='Snakes per game. Default 4.')
+    parser.add_argument('-g', '--game_mode', default='standard', choices=GAME_MODES,
+                        help='Game mode. Default standard.')
+    parser.add_argument('--width', default=11, type=int,
+                        help='Board width. Default 11.')
+    parser.add_argument('--height', default=11, type=int,
+                        help='Board height. Default 11.')
+    parser.add_argument('--max_turns', default=None, type=int,
+                        help='Stop games after this many turns. Default no limit.')
+    parser.add_argument('-p', '--policy', default='safe', choices=('safe', 'model'),
+                        help='safe plays like main.py, model like sl_snake.py. Default safe.')
+    parser.add_argument('-m', '--model', default='newConv_2.npz',
+                        help='Filename of the model the model policy predicts with, as sl_snake.py -m. Default newConv_2.npz.')
+    parser.add_argument('-o', '--output', default='snakeSupervision/shards',
+                        help='Dataset directory the examples are added to. Default snakeSupervision/shards.')
+    parser.add_argument('--shard_size', default=SHARD_SIZE, type=int,
+                        help=f'Examples per shard. Default {SHARD_SIZE}.')
+    parser.add_argument('-a', '--augment', action='store_true',
+                        help='Also add every example turned and mirrored, 8 per example on square boards')
+    parser.add_argument('--seed', default=None, type=int,
+                        help='Random seed. Default random.')
+    args = parser.parse_args()
+
+    if args.policy == 'model':
+        from snakeSupervision.predictor import Predictor
+        policy = predictor_policy(Predictor(args.model))
+    else:
+        policy = safe_policy
+
+    sim = BatchSimulator(min(args.boards, args.games), args.snakes, args.width, args.height,
+                         args.game_mode, args.seed, max_turns=args.max_turns)
+    writer = ShardWriter(args.output, args.shard_size)
+    recorder = ExampleRecorder(sim, writer, args.augment)
+    started = sim.boards
+    finished = 0
+    turns = 0
+    start = time.perf_counter()
+    while finished < args.games:
+        ended = recorder.step(sim.choose_moves(policy(sim)))
+        turns += int((~sim.done | ended).sum())
+        finished += int(ended.sum())
+        # Start new games on the finished boards until every game is started
+        restart = np.flatnonzero(ended)[:max(args.games - started, 0)]
+        if len(restart) > 0:
+            sim.reset(np.isin(np.arange(sim.boards), restart))
+            started += len(restart)
+    writer.close()
+    seconds = time.perf_counter() - start
+    print(f"{finished} games, {turns} turns, {recorder.examples} examples in {seconds:.1f} s "
+          f"({finished / seconds:.1f} games/s, {turns / seconds:.0f} turns/s)")
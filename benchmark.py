@@ -0,0 +1,165 @@
+# Benchmarks the snakes' move() on recorded games.
+#
+# Replays the game states sl_snake.py saves with --save_games (one file per game
+# under games/) through each snake in turn order, so incremental state like the
+# board tracker behaves as it does in a live game. Reports latency percentiles
+# and memory allocated per move, grouped by board size and number of snakes.
+#
+# --save_baseline stores the results as JSON. --baseline compares against a stored
+# baseline and exits with status 1 if any group's p95 latency is more than
+# --threshold slower than before.
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+import typing
+
+import numpy as np
+
+from game_record import game_paths, read_game
+from rules import load_snake, snake_modules
+
+PERCENTILES = (50, 95, 99)
+
+
+# Stands in for sl_snake's Predictor to benchmark the snake without its model
+class StubPredictor:
+    def predict_batch(self, game_state: typing.Dict, actions: typing.List[str],
+                      subject: str) -> typing.List[typing.Tuple[str, float]]:
+        return [(action, 0.5) for action in actions]
+
+
+# Given a directory of saved games, return the game states of each game in turn order
+def load_games(games_dir: str) -> typing.List[typing.List[typing.Dict]]:
+    games = []
+    for path in game_paths(games_dir):
+        states = read_game(path)['states']
+        if len(states) > 0:
+            games.append(sorted(states, key=lambda state: state['turn']))
+    return games
+
+
+# Return the group a game state is reported in
+def group_name(game_state: typing.Dict) -> str:
+    board = game_state['board']
+    return f"{board['width']}x{board['height']} {len(board['snakes'])} snakes"
+
+
+# Replay every game through handlers and return the seconds taken by each move, by group.
+# With trace_memory, return the bytes allocated at the peak of each move instead
+def replay(handlers: typing.Dict, games: typing.List[typing.List[typing.Dict]],
+           trace_memory: bool = False) -> typing.Dict[str, typing.List[float]]:
+    samples = {}
+    for states in games:
+        handlers['start'](states[0])
+        for game_state in states:
+            if trace_memory:
+                tracemalloc.reset_peak()
+                start = tracemalloc.get_traced_memory()[0]
+                handlers['move'](game_state)
+                sample = tracemalloc.get_traced_memory()[1] - start
+            else:
+                start = time.perf_counter()
+                handlers['move'](game_state)
+                sample = time.perf_counter() - start
+            samples.setdefault(group_name(game_state), []).append(sample)
+        handlers['end'](states[-1])
+    return samples
+
+
+# Given the games and a snake spec, return the benchmark results of its moves by group
+def benchmark_snake(spec: str, games: typing.List[typing.List[typing.Dict]], repeats: int = 1,
+                    stub_model: bool = False) -> typing.Dict[str, typing.Dict]:
+    handlers = load_snake(spec)
+    if stub_model and hasattr(snake_modules[spec], 'predictor'):
+        snake_modules[spec].predictor = StubPredictor()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        # Warm up caches and lazily loaded modules before timing
+        replay(handlers, games[:1])
+        latencies = {}
+        for _ in range(repeats):
+            for group, samples in replay(handlers, games).items():
+                latencies.setdefault(group, []).extend(samples)
+        tracemalloc.start()
+        try:
+            allocations = replay(handlers, games, trace_memory=True)
+        finally:
+            tracemalloc.stop()
+    results = {}
+    for group, samples in sorted(latencies.items()):
+        milliseconds = np.asarray(samples) * 1000
+        result = {'moves': len(samples)}
+        for percentile in PERCENTILES:
+            result[f"p{percentile}_ms"] = float(np.percentile(milliseconds, percentile))
+        result['max_ms'] = float(milliseconds.max())
+        result['mean_alloc_kb'] = float(np.mean(allocations[group]) / 1024)
+        result['max_alloc_kb'] = float(np.max(allocations[group]) / 1024)
+        results[group] = result
+    return results
+
+
+# Given results and a baseline, both indexed as [snake spec][group], return a message for
+# every group whose p95 latency grew by more than threshold
+def find_regressions(results: typing.Dict, baseline: typing.Dict, threshold: float) -> typing.List[str]:
+    regressions = []
+    for spec, groups in results.items():
+        for group, result in groups.items():
+            if group not in baseline.get(spec, {}):
+                continue
+            before = baseline[spec][group]['p95_ms']
+            if result['p95_ms'] > before * (1 + threshold):
+                regressions.append(f"{spec} {group}: p95 {before:.2f} ms -> {result['p95_ms']:.2f} ms")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--snake', action='append', default=None,
+                        help='Snake script and its arguments, e.g. "sl_snake -m newConv_2.npz". Repeat for each snake. '
+                             'Default main, flood_filler and sl_snake.')
+    parser.add_argument('-g', '--games_dir', default='games',
+                        help='Directory of games saved by sl_snake.py --save_games. Default games.')
+    parser.add_argument('-r', '--repeats', default=3, type=int,
+                        help='Times every move is timed. Default 3.')
+    parser.add_argument('--stub_model', action='store_true',
+                        help="Replace sl_snake's model with a stub that rates every move the same")
+    parser.add_argument('--baseline', default=None,
+                        help='Baseline results to compare against')
+    parser.add_argument('--save_baseline', default=None,
+                        help='Path to store the results as a baseline')
+    parser.add_argument('-t', '--threshold', default=0.2, type=float,
+                        help='Fraction p95 latency may grow over the baseline before failing. Default 0.2.')
+    args = parser.parse_args()
+
+    games = load_games(args.games_dir)
+    if len(games) == 0:
+        sys.exit(f"No saved games in {args.games_dir}")
+    specs = args.snake or ['main', 'flood_filler', 'sl_snake -m newConv_2.npz']
+    results = {}
+    for spec in specs:
+        results[spec] = benchmark_snake(spec, games, args.repeats, args.stub_model)
+        print(spec)
+        print("Group              | Moves  | p50 ms  | p95 ms  | p99 ms  | Max ms  | Mean KB | Max KB")
+        print("------------------------------------------------------------------------------------------")
+        for group, result in results[spec].items():
+            print(
+                f"{group:<18} | {result['moves']:<6} | {result['p50_ms']:<7.3f} | {result['p95_ms']:<7.3f} | "
+                f"{result['p99_ms']:<7.3f} | {result['max_ms']:<7.3f} | {result['mean_alloc_kb']:<7.1f} | "
+                f"{result['max_alloc_kb']:.1f}"
+            )
+        print()
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as fp:
+            regressions = find_regressions(results, json.load(fp), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if len(regressions) > 0:
+            sys.exit(1)
@@ -0,0 +1,256 @@
+# Compact board model shared by all of the snakes.
+#
+# Cells are stored as flat integer indices (cell = y * width + x) and every
+# per-cell plane is a flat `array`, so a turn allocates a handful of arrays
+# instead of nested lists and one dict per coordinate. Neighbour and move
+# tables only depend on the board size, so they are computed once per size.
+#
+# The obstacle plane stores the turn at which each body part leaves its cell,
+# so a part's lifetime is obstacles[cell] - board.turn and cells whose value is
+# not greater than board.turn are free. Storing turns instead of lifetimes means
+# a snake moving forward only changes its head and tail cells, which lets
+# BoardTracker update a game's board from one turn to the next.
+
+import functools
+import typing
+from array import array
+
+DIRECTIONS = ('up', 'down', 'left', 'right')
+# Move table value for a move that leaves the board
+OFF_BOARD = -1
+
+
+# Convert x, y coordinates to a flat cell index
+def to_cell(width: int, x: int, y: int) -> int:
+    return y * width + x
+
+
+# Convert a flat cell index back to a Battlesnake coordinate dict
+def to_pos(width: int, cell: int) -> typing.Dict:
+    return {'x': cell % width, 'y': cell // width}
+
+
+# Given a board size, return a table mapping each direction to a tuple indexed
+# by cell, holding the cell reached by that move or OFF_BOARD
+@functools.lru_cache(maxsize=None)
+def get_move_table(width: int, height: int) -> typing.Dict[str, typing.Tuple[int, ...]]:
+    table = {direction: [] for direction in DIRECTIONS}
+    for cell in range(width * height):
+        x, y = cell % width, cell // width
+        table['up'].append(cell + width if y < height - 1 else OFF_BOARD)
+        table['down'].append(cell - width if y > 0 else OFF_BOARD)
+        table['left'].append(cell - 1 if x > 0 else OFF_BOARD)
+        table['right'].append(cell + 1 if x < width - 1 else OFF_BOARD)
+    return {direction: tuple(cells) for direction, cells in table.items()}
+
+
+# Given a board size, return a tuple indexed by cell of all in-bound
+# neighbouring cells, ordered up, down, left, right
+@functools.lru_cache(maxsize=None)
+def get_neighbors(width: int, height: int) -> typing.Tuple[typing.Tuple[int, ...], ...]:
+    moves = get_move_table(width, height)
+    return tuple(
+        tuple(
+            moves[direction][cell]
+            for direction in DIRECTIONS
+            if moves[direction][cell] != OFF_BOARD
+        )
+        for cell in range(width * height)
+    )
+
+
+# Zeroed planes to copy from, so a new board never builds a list per cell
+@functools.lru_cache(maxsize=None)
+def _empty_plane(typecode: str, size: int) -> array:
+    return array(typecode, bytes(array(typecode).itemsize * size))
+
+
+class Board:
+    __slots__ = (
+        'width', 'height', 'size', 'moves', 'neighbors',
+        'obstacles', 'food', 'owner', 'food_cells',
+        'snake_ids', 'bodies', 'healths', 'you', 'you_owner', 'turn', 'cache',
+    )
+
+    def __init__(self, width: int, height: int, turn: int = 0):
+        self.width = width
+        self.height = height
+        self.size = width * height
+        self.turn = turn
+        self.moves = get_move_table(width, height)
+        self.neighbors = get_neighbors(width, height)
+        # Turn at which the body part occupying each cell leaves it
+        self.obstacles = array('i', _empty_plane('i', self.size))
+        # 1 where there is food
+        self.food = array('b', _empty_plane('b', self.size))
+        # Index + 1 of the snake occupying each cell, 0 if empty
+        self.owner = array('b', _empty_plane('b', self.size))
+        self.food_cells = []
+        # Per snake data, in the order of game_state['board']['snakes']
+        self.snake_ids = []
+        self.bodies = []
+        self.healths = []
+        # Index of our snake, -1 if we are not on the board
+        self.you = -1
+        # Owner plane value of our snake, never matches an empty cell
+        self.you_owner = -1
+        # Results derived from this board, e.g. path lengths, reused within a turn
+        self.cache = {}
+
+    # Build a board from a Battlesnake game state
+    @classmethod
+    def from_game_state(cls, game_state: typing.Dict) -> 'Board':
+        width = game_state['board']['width']
+        board = cls(width, game_state['board']['height'], game_state['turn'])
+        for food_pos in game_state['board']['food']:
+            board.add_food(food_pos['y'] * width + food_pos['x'])
+        you_id = game_state['you']['id']
+        for snake in game_state['board']['snakes']:
+            body = [part['y'] * width + part['x'] for part in snake['body']]
+            board.add_snake(snake['id'], body, snake['health'])
+            if snake['id'] == you_id:
+                board.you = len(board.bodies) - 1
+                board.you_owner = board.you + 1
+        return board
+
+    def add_food(self, cell: int):
+        self.food[cell] = 1
+        self.food_cells.append(cell)
+
+    # Add a snake given its body as a list of cells, head first
+    def add_snake(self, snake_id: str, body: typing.List[int], health: int):
+        self.snake_ids.append(snake_id)
+        self.bodies.append(body)
+        self.healths.append(health)
+        owner = len(self.bodies)
+        # Tail first so stacked parts keep the body's value
+        self.owner[body[-1]] = owner
+        # Turn at which the tail leaves
+        tail_turn = self.turn + len(body) - 1
+        obstacles = self.obstacles
+        # Back to front so stacked parts keep the turn the frontmost one leaves
+        for i in range(len(body) - 2, -1, -1):
+            cell = body[i]
+            # Store distance of body part to it's own tail
+            # If snake just ate, tail pos is 1 otherwise it is 0
+            obstacles[cell] = tail_turn - i
+            self.owner[cell] = owner
+
+    def to_cell(self, pos: typing.Dict) -> int:
+        return pos['y'] * self.width + pos['x']
+
+    def to_pos(self, cell: int) -> typing.Dict:
+        return to_pos(self.width, cell)
+
+    def head(self, index: int) -> int:
+        return self.bodies[index][0]
+
+
+# Keeps one game's board up to date between turns. Each turn the incoming game
+# state is checked against the previous board and, if every snake simply moved
+# forward, only heads, tails, health and food are updated. Anything else
+# (eliminations, skipped turns, a new game) falls back to a full rebuild
+class BoardTracker:
+    def __init__(self):
+        self.board = None
+        self.updates = 0
+        self.rebuilds = 0
+
+    # Return the board for game_state
+    def update(self, game_state: typing.Dict) -> Board:
+        if self.board is None or not self._advance(game_state):
+            self.board = Board.from_game_state(game_state)
+            self.rebuilds += 1
+        else:
+            self.updates += 1
+        return self.board
+
+    # Advance the tracked board by one turn, return False if game_state doesn't
+    # follow from it. The board must be rebuilt after a False return
+    def _advance(self, game_state: typing.Dict) -> bool:
+        board = self.board
+        snakes = game_state['board']['snakes']
+        if (
+            game_state['turn'] != board.turn + 1
+            or game_state['board']['width'] != board.width
+            or game_state['board']['height'] != board.height
+            or len(snakes) != len(board.bodies)
+        ):
+            return False
+        width = board.width
+        # Check that every snake moved forward one cell, growing by at most one
+        heads = []
+        for i, snake in enumerate(snakes):
+            body = board.bodies[i]
+            new_body = snake['body']
+            if snake['id'] != board.snake_ids[i] or len(body) < 2:
+                return False
+            head = new_body[0]['y'] * width + new_body[0]['x']
+            tail = new_body[-1]['y'] * width + new_body[-1]['x']
+            grew = len(new_body) - len(body)
+            if head not in board.neighbors[body[0]] or grew not in (0, 1) or tail != body[-2]:
+                return False
+            heads.append((head, grew == 1))
+        board.turn += 1
+        obstacles = board.obstacles
+        owner = board.owner
+        # Free the tails first, another snake's head may follow into them
+        for body, (head, grew) in zip(board.bodies, heads):
+            tail = body.pop()
+            if body[-1] != tail:
+                owner[tail] = 0
+            body.insert(0, head)
+            if grew:
+                body.append(body[-1])
+                # Every part stays one turn longer
+                for cell in body[1:-1]:
+                    obstacles[cell] += 1
+        for i, (head, grew) in enumerate(heads):
+            obstacles[head] = board.turn + len(board.bodies[i]) - 1
+            owner[head] = i + 1
+            board.healths[i] = snakes[i]['health']
+        # Update food
+        food = board.food
+        new_food = [pos['y'] * width + pos['x'] for pos in game_state['board']['food']]
+        for cell in board.food_cells:
+            food[cell] = 0
+        for cell in new_food:
+            food[cell] = 1
+        board.food_cells = new_food
+        board.cache = {}
+        return True
+
+
+# Given board, head cell, and current move risks, determines fatal out-of-bounds moves
+# returns updated move risks
+def avoid_walls(board: Board, head: int, danger_risk: typing.Dict) -> typing.Dict:
+    for move in danger_risk:
+        if board.moves[move][head] == OFF_BOARD:
+            danger_risk[move] += 1
+    return danger_risk
+
+
+# Given board, head cell & current move risk, determines moves that will be fatal colision
+# with any snake body. Returns updated move risk.
+def avoid_snake_bodies(board: Board, head: int, danger_risk: typing.Dict) -> typing.Dict:
+    obstacles = board.obstacles
+    for move in danger_risk:
+        mov_cell = board.moves[move][head]
+        # If an obstacle is at move position, add 1 to risk
+        if mov_cell != OFF_BOARD and obstacles[mov_cell] > board.turn:
+            danger_risk[move] += 1
+    return danger_risk
+
+
+# Given board, head cell & current move risk, adds risk to moves that could end in a
+# head-to-head collision with a snake at least as long as ours
+def avoid_heads(board: Board, head: int, danger_risk: typing.Dict) -> typing.Dict:
+    my_length = len(board.bodies[board.you])
+    for body in board.bodies:
+        if len(body) < my_length:
+            continue
+        next_cells = board.neighbors[body[0]]
+        for move in danger_risk:
+            if board.moves[move][head] in next_cells:
+                danger_risk[move] += 0.25
+    return danger_risk
@@ -0,0 +1,154 @@
+# Bounded, deadline aware flood fill over a Board.
+#
+# The fill is a depth first search for the longest safe path from a cell,
+# taking into account that body parts disappear as the snake moves. Paths are
+# tracked with a per-cell array instead of copied lists, and the search can be
+# cut off by a wall clock deadline, in which case the longest path found so
+# far is returned. a_star finds the shortest safe path between two cells under
+# the same rules.
+
+import heapq
+import time
+import typing
+from array import array
+
+from board import Board
+from zobrist import TranspositionTable, board_hash
+
+# Number of expansions between deadline checks
+CHECK_EVERY = 128
+
+
+# Given a cell and time to reach it, return all adjacent cells that are
+# in bounds and have obstacles with lifespans less than time_to_reach. Account for
+# food count with self-collisions
+def get_adjacent_safe(board: Board, cell: int, time_to_reach: int, food_count: int) -> typing.List[int]:
+    obstacles = board.obstacles
+    owner = board.owner
+    you_owner = board.you_owner
+    # Compare turns rather than lifetimes
+    time_to_reach += board.turn
+    safe = []
+    for adj in board.neighbors[cell]:
+        # Check for self collision
+        if owner[adj] == you_owner:
+            if time_to_reach > obstacles[adj] + food_count:
+                safe.append(adj)
+        elif time_to_reach > obstacles[adj]:
+            safe.append(adj)
+    return safe
+
+
+# Given the path so far, return the children of the cell at the end of it that are
+# worth exploring, marking them in visited
+def _expand(board: Board, cell: int, path_len: int, food_in_path: int,
+            visited: array, path_index: array, my_length: int) -> typing.List[int]:
+    children = []
+    for child in get_adjacent_safe(board, cell, path_len + 1, food_in_path):
+        # Check if this path intersects itself too soon
+        if path_index[child] != -1 and (path_len - path_index[child]) < (my_length + 1):
+            continue
+        # Check if this is longest path found to this point
+        if path_len + 1 > visited[child]:
+            # Mark visited with current path length (including new node)
+            visited[child] = path_len + 1
+            children.append(child)
+    return children
+
+
+# Given a start cell, return the length of the longest safe path found from it and
+# whether the search finished. The search stops once a path longer than max_volume
+# is found, or when time.perf_counter() passes deadline
+def flood_fill(board: Board, start_cell: int, max_volume: int,
+               deadline: typing.Optional[float] = None) -> typing.Tuple[int, bool]:
+    food = board.food
+    my_length = len(board.bodies[board.you])
+    # Longest path found to each cell
+    visited = array('i', bytes(4 * board.size))
+    # Index of each cell in the current path, -1 if not in it
+    path_index = array('i', [-1]) * board.size
+    path_index[start_cell] = 0
+    # Stack of (cell, children left to explore, food in path, whether the cell set
+    # its own path_index). The stack depth is the current path length
+    children = _expand(board, start_cell, 1, food[start_cell], visited, path_index, my_length)
+    stack = [(start_cell, children, food[start_cell], True)]
+    volume = 1
+    expansions = 0
+    while volume <= max_volume and len(stack) > 0:
+        cell, children, food_in_path, owns_index = stack[-1]
+        if len(children) == 0:
+            # Backtrack
+            stack.pop()
+            if owns_index:
+                path_index[cell] = -1
+            continue
+        node = children.pop()
+        path_len = len(stack) + 1
+        if path_len > volume:
+            volume = path_len
+        expansions += 1
+        if deadline is not None and expansions % CHECK_EVERY == 0 and time.perf_counter() > deadline:
+            return volume, False
+        food_in_path += food[node]
+        owns_index = path_index[node] == -1
+        if owns_index:
+            path_index[node] = path_len - 1
+        children = _expand(board, node, path_len, food_in_path, visited, path_index, my_length)
+        stack.append((node, children, food_in_path, owns_index))
+    return volume, True
+
+
+# flood_fill() that reuses finished results stored in a transposition table
+def cached_flood_fill(board: Board, start_cell: int, max_volume: int,
+                      deadline: typing.Optional[float] = None,
+                      table: typing.Optional[TranspositionTable] = None) -> typing.Tuple[int, bool]:
+    if table is None:
+        return flood_fill(board, start_cell, max_volume, deadline)
+    key = ('fill', board_hash(board), start_cell, max_volume)
+    volume = table.get(key)
+    if volume is not None:
+        return volume, True
+    volume, complete = flood_fill(board, start_cell, max_volume, deadline)
+    if complete:
+        table.put(key, volume)
+    return volume, complete
+
+
+# Get manhattan distance between two cells
+def man_dist(board: Board, from_cell: int, to_cell: int) -> int:
+    width = board.width
+    return abs(to_cell % width - from_cell % width) + abs(to_cell // width - from_cell // width)
+
+
+# Given a start and an end cell, return the shortest safe path between them as a list
+# of cells, both ends included, or None if there is none
+def a_star(board: Board, start_cell: int, end_cell: int) -> typing.Optional[typing.List[int]]:
+    food = board.food
+    # Length of the shortest path found to each cell, 0 if none yet
+    best = array('i', bytes(4 * board.size))
+    parents = array('i', [-1]) * board.size
+    best[start_cell] = 1
+    # Open set, a heap of (path length + manhattan distance, path length, cell, food in path)
+    frontier = [(1 + man_dist(board, start_cell, end_cell), 1, start_cell, food[start_cell])]
+    while len(frontier) > 0:
+        _, path_len, cell, food_count = heapq.heappop(frontier)
+        # A shorter path to this cell was found after this one was pushed
+        if path_len > best[cell]:
+            continue
+        if cell == end_cell:
+            path = [cell]
+            while cell != start_cell:
+                cell = parents[cell]
+                path.append(cell)
+            path.reverse()
+            return path
+        for next_cell in get_adjacent_safe(board, cell, path_len + 1, food_count):
+            if best[next_cell] != 0 and best[next_cell] <= path_len + 1:
+                continue
+            best[next_cell] = path_len + 1
+            parents[next_cell] = cell
+            heapq.heappush(frontier, (
+                path_len + 1 + man_dist(board, next_cell, end_cell), path_len + 1,
+                next_cell, food_count + food[next_cell]
+            ))
+    return None
@@ -12,8 +12,15 @@
 
 import argparse
 import random
+import time
 import typing
-import json
+from array import array
+
+import metrics
+from board import Board, BoardTracker, OFF_BOARD, avoid_walls, avoid_snake_bodies, avoid_heads
+from flood_fill import cached_flood_fill, get_adjacent_safe
+from move_watchdog import move_deadline, publish_move
+from zobrist import TranspositionTable
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-c', '--color',
@@ -23,6 +30,20 @@ parser.add_argument('-p', '--port', default='8001',
                     help='Port to run Battlesnake on. Default 8001.')
 parser.add_argument('-d', '--deployed', action='store_true',
                     help='Opens server to the internet')
+parser.add_argument('-w', '--workers', default=0, type=int,
+                    help='Number of worker processes serving games. Default 0 runs the single process development server.')
+parser.add_argument('--keep_alive', default=5, type=int,
+                    help='Seconds an idle connection is kept open when running with workers. Default 5.')
+parser.add_argument('--graceful_timeout', default=10, type=int,
+                    help='Seconds to finish requests in flight on SIGTERM when running with workers. Default 10.')
+parser.add_argument('--watchdog_margin', default=50, type=int,
+                    help='Milliseconds before the move timeout at which the best move found so far is sent. Default 50.')
+parser.add_argument('--threads', default=32, type=int,
+                    help='Threads answering requests with workers, at least the number of games played at once. Default 32.')
+parser.add_argument('--time_margin', default=100, type=int,
+                    help='Milliseconds of the move timeout kept free for network latency. Default 100.')
+parser.add_argument('--table_size', default=200000, type=int,
+                    help='Maximum number of transposition table entries kept per game. Default 200000.')
 parser.add_argument('--print_level', default=2, type=int, choices=[1, 2, 3],
                     help='''1: silence all prints
             2: (Default) silence move(), info(), start()
@@ -39,7 +60,7 @@ stats = {
     'turns': []
 }
 # To handle multiple instance of this snake in the same game
-# Indexed as ongoing_games[game_id][snake_id] = [body_length, turns_survived]
+# Indexed as ongoing_games[game_id][snake_id] = [body_length, turns_survived, board_tracker, transposition_table]
 ongoing_games = {}
 
 # info is called when you create your Battlesnake on play.battlesnake.com
@@ -65,219 +86,70 @@ def start(game_state: typing.Dict):
     global ongoing_games
     if game_state['game']['id'] not in ongoing_games:
         ongoing_games[game_state['game']['id']] = {}
-    ongoing_games[game_state['game']['id']][game_state['you']['id']] = [len(game_state['you']['body']), 0]
-
-
-# Given a game state, perform common preprocessing and return results
-def preprocess(game_state: typing.Dict):
-    # Create obstacles array storing each body part's expected lifetime
-    obstacles = [
-        [0] * game_state['board']['height']
-        for x in range(game_state['board']['width'])
-    ]
-    for snake in game_state['board']['snakes']:
-        snake_length = len(snake['body'])
-        for i, body_part in enumerate(snake['body'][:-1]):
-            # Store distance of body part to it's own tail
-            # If snake just ate, tail pos is 1 otherwise it is 0
-            obstacles[body_part['x']][body_part['y']] = snake_length - (i + 1)
-    # Create food array
-    food = [
-        [0] * game_state['board']['height']
-        for x in range(game_state['board']['width'])
-    ]
-    for food_pos in game_state['board']['food']:
-        food[food_pos['x']][food_pos['y']] = 1
-    return obstacles, food
-
-
-# Get manhattan distance between two points
-def man_dist(from_pos: typing.Dict, to_pos: typing.Dict):
-    return abs(to_pos['x'] - from_pos['x']) + abs(to_pos['y'] - from_pos['y'])
-
-
-# Perform A star search from start_pos to end_pos, return path
-def a_star(game_state: typing.Dict, obstacles: list, food: list, start_pos: typing.Dict, end_pos: typing.Dict):
-    # Frontier stores path, number of food in path, and manhattan distance to end
-    frontier = []
-    explored = [
-        [-1] * game_state['board']['height']
-        for x in range(game_state['board']['width'])
+    ongoing_games[game_state['game']['id']][game_state['you']['id']] = [
+        len(game_state['you']['body']), 0, BoardTracker(), TranspositionTable(args.table_size)
     ]
-    if food[start_pos['x']][start_pos['y']] == 1:
-        frontier.append(([start_pos], 1, man_dist(start_pos, end_pos)))
-    else:
-        frontier.append(([start_pos], 0, man_dist(start_pos, end_pos)))
-    while len(frontier) > 0:
-        # Get next position to explore
-        path, food_count, h = frontier.pop(0)
-        cur_pos = path[-1]
-        # If we've reached the end, return path
-        if cur_pos == end_pos:
-            return path
-        # If we haven't explored this position or we've explored it with a longer path, explore it
-        if explored[cur_pos['x']][cur_pos['y']] == -1 or explored[cur_pos['x']][cur_pos['y']] > len(path):
-            explored[cur_pos['x']][cur_pos['y']] = len(path)
-            adjacent = get_adjacent_safe(game_state, obstacles, cur_pos, len(path)+1, food_count)
-            for next_pos in adjacent:
-                new_path = path.copy()
-                new_path.append(next_pos)
-                if food[next_pos['x']][next_pos['y']] == 1:
-                    frontier.append((new_path, food_count+1, man_dist(next_pos, end_pos)))
-                else:
-                    frontier.append((new_path, food_count, man_dist(next_pos, end_pos)))
-        # Sort frontier by manhattan distance + path length
-        frontier.sort(key=lambda x: x[2] + len(x[0]))
-    return None
 
 
-# Given a position, return shortest distance to food
-def get_food_dist(game_state: typing.Dict, obstacles: list, food: list, position: typing.Dict):
-    shortest_dist = game_state['board']['width'] * game_state['board']['height'] + 1
-    for food_pos in game_state['board']['food']:
-        # Man distance is a lower bound on the actual distance
-        if man_dist(position, food_pos) > shortest_dist:
-            continue
-        path = a_star(game_state, obstacles, food, position, food_pos)
-        if path is not None:
-            if len(path) < shortest_dist:
-                shortest_dist = len(path)
+# Given a start cell, return an array holding the length of the shortest safe path
+# (counting both ends) to every cell, 0 where unreachable. Results are cached on the board
+def get_path_lengths(board: Board, start_cell: int) -> array:
+    key = ('path_lengths', start_cell)
+    if key in board.cache:
+        return board.cache[key]
+    food = board.food
+    lengths = array('i', bytes(4 * board.size))
+    food_counts = array('i', bytes(4 * board.size))
+    lengths[start_cell] = 1
+    food_counts[start_cell] = food[start_cell]
+    # Breadth first, one layer per turn, so every cell is reached as early as possible
+    layer = [start_cell]
+    path_len = 1
+    while len(layer) > 0:
+        path_len += 1
+        next_layer = []
+        for cell in layer:
+            for next_cell in get_adjacent_safe(board, cell, path_len, food_counts[cell]):
+                if lengths[next_cell] == 0:
+                    lengths[next_cell] = path_len
+                    food_counts[next_cell] = food_counts[cell] + food[next_cell]
+                    next_layer.append(next_cell)
+        layer = next_layer
+    board.cache[key] = lengths
+    return lengths
+
+
+# Given a cell, return shortest distance to food
+def get_food_dist(board: Board, cell: int):
+    shortest_dist = board.size + 1
+    if cell == OFF_BOARD or len(board.food_cells) == 0:
+        return shortest_dist
+    lengths = get_path_lengths(board, cell)
+    for food_cell in board.food_cells:
+        if 0 < lengths[food_cell] < shortest_dist:
+            shortest_dist = lengths[food_cell]
     return shortest_dist
 
 
-# Given a position, return all adjacent positions that are in bounds
-def get_adjacent(game_state: typing.Dict, position: typing.Dict):
-    up = {'x': position['x'], 'y': position['y']+1}
-    down = {'x': position['x'], 'y': position['y']-1}
-    left = {'x': position['x']-1, 'y': position['y']}
-    right = {'x': position['x']+1, 'y': position['y']}
-    return [
-        pos for pos in [up, down, left, right]
-        if pos['y'] >= 0
-        if pos['y'] < game_state['board']['height']
-        if pos['x'] >= 0
-        if pos['x'] < game_state['board']['width']
-    ]
-
-
-# Given a position and time to reach it, return all adjacent positions that are
-# in bounds and have obstacles with lifespans less than time_to_reach. Account for
-# food count with self-collisions
-def get_adjacent_safe(game_state: typing.Dict, obstacles: list, position: typing.Dict, time_to_reach: int, food_count: int):
-    adjacent_positions = get_adjacent(game_state, position)
-    safe = []
-    for pos in adjacent_positions:
-        # Check for self collision
-        if pos in game_state['you']['body']:
-            if time_to_reach > obstacles[pos['x']][pos['y']] + food_count:
-                safe.append(pos)
-        elif time_to_reach > obstacles[pos['x']][pos['y']]:
-            safe.append(pos)
-    return safe
-
-
-# Given head position and direction, return the new head position
-def get_move_position(head: typing.Dict, direction: str)-> typing.Dict:
-    if direction not in ['up', 'down', 'left', 'right']:
-        raise Exception('Invalid direction')
-    if direction == 'up':
-        return {'y': head['y']+1, 'x': head['x']}
-    elif direction == 'down':
-        return {'y': head['y']-1, 'x': head['x']}
-    elif direction == 'left':
-        return {'x': head['x']-1, 'y': head['y']}
-    else:
-        return {'x': head['x']+1, 'y': head['y']}
-
-
-# Given game state, head position, and current move risks, determines fatal out-of-bounds moves
-# returns updated move risks
-def avoid_walls(game_state: typing.Dict, head_pos: typing.Dict, danger_risk: typing.Dict) -> typing.Dict:
-    # Left wall is at x = -1, don't go there
-    if head_pos['x'] == 0:
-        danger_risk['left'] += 1
-    # Right wall is at x = board_width, don't go there
-    elif head_pos['x'] == game_state['board']['width']-1:
-        danger_risk['right'] += 1
-    # Bottom wall is at y = -1, don't go there
-    if head_pos['y'] == 0:
-        danger_risk['down'] += 1
-    # Top wall is at y = board_height, don't go there
-    elif head_pos['y'] == game_state['board']['height']-1:
-        danger_risk['up'] += 1
-    return danger_risk
-
-
-# Given obstacles array, head position & current move risk, determines moves that will be fatal colision
-# with any snake body. Returns updated move risk.
-def avoid_snake_bodies(obstacles: list, head_pos: typing.Dict, danger_risk: typing.Dict) -> typing.Dict:
-    for move in danger_risk:
-        mov_pos = get_move_position(head_pos, move)
-        # Ensure that move is in bounds
-        if mov_pos['x'] >= 0 and mov_pos['x'] < len(obstacles):
-            if mov_pos['y'] >= 0 and mov_pos['y'] < len(obstacles[0]):
-                # If an obstacle is at move position, add 1 to risk
-                if obstacles[mov_pos['x']][mov_pos['y']] > 0:
-                    danger_risk[move] += 1
-    return danger_risk
-
-
-def avoid_heads(game_state: typing.Dict, danger_risk: typing.Dict) -> typing.Dict:
-    my_head = game_state['you']['head']
-    my_length = len(game_state['you']['body'])
-    for snake in game_state['board']['snakes']:
-        head = snake['body'][0]
-        next_positions = get_adjacent(game_state, head)
-        for move in danger_risk:
-            move_pos = get_move_position(my_head, move)
-            if move_pos in next_positions:
-                if len(snake['body']) >= my_length:
-                    danger_risk[move] += 0.25
-    return danger_risk
-
-
-# Given a list of positions, return their expected volumes
-def flood_fill_dfs(game_state: typing.Dict, obstacles: list, food: list, fill_from: typing.List) -> "list[typing.Dict]":
+# Given a list of cells, return their expected volumes. Each fill gets an equal share
+# of the time left before deadline
+def flood_fill_dfs(board: Board, fill_from: typing.List[int],
+                   deadline: typing.Optional[float] = None,
+                   table: typing.Optional[TranspositionTable] = None) -> "list[typing.Tuple[int, int]]":
     volumes = []
-    # Run DFS until path of max_depth found
-    for pos in fill_from:
-        # Stack to track head pos, current path, and food in path
-        if food[pos['x']][pos['y']] == 1:
-            frontier = [(pos, [pos], 1)]
-        else:
-            frontier = [(pos, [pos], 0)]
-        volume = 0  # Track size of space
-        # Track longest path to a position
-        visited = [
-            [0] * game_state['board']['height']
-            for x in range(game_state['board']['width'])
-        ]
-        while volume <= len(game_state['you']['body']):
-            if len(frontier) == 0:
-                break
-            # Explore next position
-            next_pos, cur_path, food_in_path = frontier.pop(-1)
-            path_len = len(cur_path)
-            if path_len > volume:
-                volume = path_len
-            to_expand = get_adjacent_safe(game_state, obstacles, next_pos, path_len+1, food_in_path)
-            for node in to_expand:
-                # Check if this path intersects itself
-                if node in cur_path:
-                    # Check if this path intersects itself too soon
-                    if (path_len - cur_path.index(node)) < (len(game_state['you']['body']) + 1):
-                        continue
-                # Check if this is longest path found to this point
-                if path_len + 1 > visited[node['x']][node['y']]:
-                    # Mark visited with current path length (including new node)
-                    visited[node['x']][node['y']] = path_len + 1
-                    # Expand if this path is longer than obstacle's lifetime
-                    new_path = cur_path.copy()
-                    new_path.append(node)
-                    if food[node['x']][node['y']] == 1:
-                        frontier.append([node, new_path, food_in_path+1])
-                    else:
-                        frontier.append([node, new_path, food_in_path])
+    my_length = len(board.bodies[board.you])
+    for i, cell in enumerate(fill_from):
+        # Moves off the board have no volume
+        if cell == OFF_BOARD:
+            volumes.append(0)
+            continue
+        fill_deadline = None
+        if deadline is not None:
+            now = time.perf_counter()
+            fill_deadline = now + (deadline - now) / (len(fill_from) - i)
+        volume, complete = cached_flood_fill(board, cell, my_length, fill_deadline, table)
+        if not complete and args.print_level >= 3:
+            print(f"Flood fill timed out with volume {volume}")
         volumes.append(volume)
     return list(zip(fill_from, volumes))
 
@@ -287,26 +159,35 @@ def flood_fill_dfs(game_state: typing.Dict, obstacles: list, food: list, fill_fr
 # See https://docs.battlesnake.com/api/example-move for available data
 def move(game_state: typing.Dict) -> typing.Dict:
     global ongoing_games
-    ongoing_games[game_state['game']['id']][game_state['you']['id']] = [
-        len(game_state['you']['body']),
-        game_state['turn']
-    ]
+    game_info = ongoing_games[game_state['game']['id']][game_state['you']['id']]
+    game_info[0] = len(game_state['you']['body'])
+    game_info[1] = game_state['turn']
+    tracker = game_info[2]
+    table = game_info[3]
+
+    # Leave time_margin of the game's timeout for the response to reach the server,
+    # counted from the request's arrival
+    deadline = move_deadline(game_state, args.time_margin)
 
     # Perform pre-processing
-    obstacles, food = preprocess(game_state)
+    with metrics.phase('preprocess'):
+        board = tracker.update(game_state)
 
     directions = ["up", "down", "left", "right"]
     danger_risk = {"up": 0.0, "down": 0.0, "left": 0.0, "right": 0.0}
-    my_head = game_state['you']['head']
+    my_head = board.head(board.you)
 
     # Avoid hitting the walls
-    danger_risk = avoid_walls(game_state, my_head, danger_risk)
+    with metrics.phase('avoid_walls'):
+        danger_risk = avoid_walls(board, my_head, danger_risk)
 
     # Avoid hitting snakes
-    danger_risk = avoid_snake_bodies(obstacles, my_head, danger_risk)
+    with metrics.phase('avoid_snake_bodies'):
+        danger_risk = avoid_snake_bodies(board, my_head, danger_risk)
 
     # Add head colision risk
-    danger_risk = avoid_heads(game_state, danger_risk)
+    with metrics.phase('avoid_heads'):
+        danger_risk = avoid_heads(board, my_head, danger_risk)
 
     # Select all moves with lowest risk
     lowest_risk = min([danger_risk[move] for move in danger_risk])
@@ -315,36 +196,44 @@ def move(game_state: typing.Dict) -> typing.Dict:
         for move in danger_risk
         if danger_risk[move] == lowest_risk
     ]
+    # Any safe move beats the engine's default if we run out of time
+    if len(safe_moves) > 0:
+        publish_move(random.choice(safe_moves))
     # If more than one safe moves, measure their volumes
     if len(safe_moves) > 1:
         # Measure volumes connected to each hypothetical move
         move_positions = [
-            get_move_position(game_state['you']['head'], move)
+            board.moves[move][my_head]
             for move in safe_moves
         ]
-        volumes = flood_fill_dfs(game_state, obstacles, food, move_positions)
+        with metrics.phase('flood_fill_dfs'):
+            volumes = flood_fill_dfs(board, move_positions, deadline, table)
         # Select volumes that are at least as big as our body
         suitable_volumes = [
             volume
             for volume in volumes
             if volume[1] >= len(game_state['you']['body'])
         ]
+        # Until a food path is found, the move with most room is the best we know
+        largest_volume = max(volumes, key=lambda volume: volume[1])
+        publish_move(safe_moves[move_positions.index(largest_volume[0])])
         # Measure length of largest snake
-        if len(game_state['board']['snakes']) > 1:
+        if len(board.bodies) > 1:
             biggest_snake = max([
-                len(snake['body'])
-                for snake in game_state['board']['snakes']
-                if snake['id'] != game_state['you']['id']
+                len(body)
+                for i, body in enumerate(board.bodies)
+                if i != board.you
             ])
         else:
             biggest_snake = 0
         if len(suitable_volumes) > 0:
             if game_state['you']['health'] < 20 or len(game_state['you']['body']) <= biggest_snake:
                 # Prioritize eating if we are not the biggest snake
-                min_dist = game_state['board']['width'] * game_state['board']['height'] + 1
+                min_dist = board.size + 1
                 chosen_volume = suitable_volumes[0]
                 for volume in suitable_volumes:
-                    dist_to_food = get_food_dist(game_state, obstacles, food, volume[0])
+                    with metrics.phase('get_food_dist'):
+                        dist_to_food = get_food_dist(board, volume[0])
                     if dist_to_food < min_dist:
                         min_dist = dist_to_food
                         chosen_volume = volume
@@ -377,7 +266,7 @@ def end(game_state: typing.Dict):
     print("GAME OVER\n")
     global ongoing_games
     stats['games'] += 1
-    max_len, turns_survived = ongoing_games[game_state['game']['id']][game_state['you']['id']]
+    max_len, turns_survived, _, _ = ongoing_games[game_state['game']['id']][game_state['you']['id']]
     stats['sizes'].append(max_len)
     stats['turns'].append(turns_survived)
     # Remove game from ongoing games
@@ -404,4 +293,5 @@ if __name__ == "__main__":
     from server import run_server
 
     run_server({"info": info, "start": start, "move": move,
-               "end": end}, args.port, args.deployed)
+               "end": end, "stats": lambda: stats}, args.port, args.deployed, args.workers,
+               args.keep_alive, args.graceful_timeout, args.watchdog_margin, args.threads)
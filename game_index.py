@@ -0,0 +1,313 @@
+# Index of the games saved by sl_snake.py --save_games, kept in SQLite.
+#
+# The index holds a row per game (ruleset, board size, snake count, turns, winner,
+# and how our snake, the one that recorded the game, did and died) and a row per
+# turn (snakes alive, our length and health). Every run brings the index up to date
+# by reading only the games added or changed since the last run, then prints the
+# paths of the games matching the filters, e.g. the 4 snake games we lost to a
+# head-to-head collision after turn 100:
+#   python game_index.py --snakes 4 --lost --death_cause head-collision --min_turns 100
+# --link puts links to the matching games in a directory that parseGameData.py and
+# benchmark.py can read.
+
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+import typing
+
+from game_record import game_paths, read_game
+from rules import (BODY_COLLISION, DEFAULT_SETTINGS, DIRECTIONS, HEAD_COLLISION, OUT_OF_HEALTH,
+                   SELF_COLLISION, WALL_COLLISION)
+
+INDEX_FILE = 'index.sqlite'
+# Death cause of a snake whose last move isn't known and whose possible moves disagree
+UNKNOWN_CAUSE = 'unknown'
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    game_id TEXT,
+    ruleset TEXT,
+    width INTEGER,
+    height INTEGER,
+    snake_count INTEGER,
+    turns INTEGER,
+    finished INTEGER,
+    winner TEXT,
+    won INTEGER,
+    our_turns INTEGER,
+    our_length INTEGER,
+    death_cause TEXT
+);
+CREATE TABLE IF NOT EXISTS turns (
+    game INTEGER NOT NULL REFERENCES games(id) ON DELETE CASCADE,
+    turn INTEGER NOT NULL,
+    snakes_alive INTEGER,
+    our_length INTEGER,
+    our_health INTEGER,
+    PRIMARY KEY (game, turn)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS games_filter ON games (snake_count, ruleset, won, death_cause);
+CREATE INDEX IF NOT EXISTS games_turns ON games (our_turns);
+"""
+GAME_COLUMNS = (
+    'game_id', 'ruleset', 'width', 'height', 'snake_count', 'turns', 'finished',
+    'winner', 'won', 'our_turns', 'our_length', 'death_cause',
+)
+
+
+# Given a game state, the snake that died after it, the move it made and the final
+# state of the game, return how the snake was eliminated following rules.Game. When
+# the move isn't known, the snake took one of the moves that can eliminate it, and the
+# cause is known if they all agree
+def death_cause(game_state: typing.Dict, snake_id: str, move: typing.Optional[str], ruleset: str,
+                final_state: typing.Optional[typing.Dict] = None) -> str:
+    board = game_state['board']
+    snakes = {snake['id']: snake for snake in board['snakes']}
+    snake = snakes[snake_id]
+    others = [other for other in snakes.values() if other is not snake]
+    food = {(pos['x'], pos['y']) for pos in board['food']}
+    hazards = {(pos['x'], pos['y']) for pos in board.get('hazards', [])}
+    # The snakes that survived the move, when the game ended on it and the final state
+    # was recorded after it. Older JSON games only saved the ids of the final snakes
+    recorded = (
+        final_state is not None and final_state.get('turn') == game_state['turn'] + 1
+        and all('body' in other for other in final_state['board']['snakes'])
+    )
+    survivors = {other['id']: other for other in final_state['board']['snakes']} if recorded else {}
+    # Cells other snakes' bodies hold after the move, not counting their heads. Snakes
+    # that didn't survive it hold every part but the old tail, whether or not they ate:
+    # growing adds a copy of the new tail, and a tail that stays because the snake ate
+    # last turn is already doubled in the body
+    bodies = set()
+    for other in others:
+        after = survivors.get(other['id'])
+        parts = after['body'][1:] if after is not None else other['body'][:-1]
+        bodies.update((part['x'], part['y']) for part in parts)
+
+    # Whether other moved onto (x, y) and was at least as long as our snake of length there
+    def met_head_on(other: typing.Dict, x: int, y: int, length: int) -> bool:
+        after = survivors.get(other['id'])
+        if after is not None:
+            return (after['head']['x'], after['head']['y']) == (x, y) and after['length'] >= length
+        if abs(other['head']['x'] - x) + abs(other['head']['y'] - y) != 1:
+            return False
+        # Eliminated along with us head on, it ate what we ate and was as long as us.
+        # When the state after the move isn't known, guess it met us
+        if recorded:
+            return other['length'] == snake['length']
+        return other['length'] >= snake['length']
+
+    causes = set()
+    for direction in ([move] if move in DIRECTIONS else DIRECTIONS):
+        dx, dy = DIRECTIONS[direction]
+        x, y = snake['head']['x'] + dx, snake['head']['y'] + dy
+        if ruleset == 'wrapped':
+            x, y = x % board['width'], y % board['height']
+        # Snakes moving onto food grow by one before collisions are checked
+        grown = int((x, y) in food)
+        health = snake['health'] - 1
+        if (x, y) in hazards and not grown:
+            health -= DEFAULT_SETTINGS['hazardDamagePerTurn']
+        if health <= 0 and not grown:
+            causes.add(OUT_OF_HEALTH)
+        elif not (0 <= x < board['width'] and 0 <= y < board['height']):
+            causes.add(WALL_COLLISION)
+        elif (x, y) in {(part['x'], part['y']) for part in snake['body'][:-1]}:
+            causes.add(SELF_COLLISION)
+        elif (x, y) in bodies:
+            causes.add(BODY_COLLISION)
+        elif any(met_head_on(other, x, y, snake['length'] + grown) for other in others):
+            causes.add(HEAD_COLLISION)
+        elif move is not None:
+            causes.add(UNKNOWN_CAUSE)
+    return causes.pop() if len(causes) == 1 else UNKNOWN_CAUSE
+
+
+# Given the path of a saved game, return its row of the games table and its rows of the turns table
+def index_game(path: str) -> typing.Tuple[typing.Dict, typing.List[typing.Tuple]]:
+    game = read_game(path)
+    states = game['states']
+    if len(states) == 0:
+        return {column: None for column in GAME_COLUMNS}, []
+    first = states[0]
+    ours = game['you']
+    turns = []
+    our_length = None
+    for state in states:
+        snake = next((snake for snake in state['board']['snakes'] if snake['id'] == ours), None)
+        if snake is not None:
+            our_length = len(snake['body'])
+        turns.append((
+            state['turn'], len(state['board']['snakes']),
+            len(snake['body']) if snake is not None else None, snake['health'] if snake is not None else None,
+        ))
+    final = game['final_state']
+    finished = final is not None
+    died = finished and all(snake['id'] != ours for snake in final['board']['snakes'])
+    cause = None
+    if died:
+        cause = death_cause(states[-1], ours, game['last_move'], first['game']['ruleset']['name'], final)
+    # The final state of JSON games has no turn, it follows the last recorded one
+    game_turns = final.get('turn', states[-1]['turn'] + 1) if finished else states[-1]['turn']
+    return {
+        'game_id': first['game']['id'],
+        'ruleset': first['game']['ruleset']['name'],
+        'width': first['board']['width'],
+        'height': first['board']['height'],
+        'snake_count': len(first['board']['snakes']),
+        'turns': game_turns,
+        'finished': int(finished),
+        'winner': game['winner'] if finished else None,
+        'won': int(game['winner'] == ours) if finished else None,
+        'our_turns': states[-1]['turn'] + 1 if died else game_turns,
+        'our_length': our_length,
+        'death_cause': cause,
+    }, turns
+
+
+# Same as index_game, for games that fail to read
+def try_index_game(path: str) -> typing.Tuple[str, typing.Optional[typing.Tuple]]:
+    try:
+        return path, index_game(path)
+    except Exception as error:
+        print(f"Skipping {path}: {error!r}", file=sys.stderr)
+        return path, None
+
+
+def open_index(path: str) -> sqlite3.Connection:
+    db = sqlite3.connect(path)
+    db.execute('PRAGMA foreign_keys = ON')
+    db.execute('PRAGMA journal_mode = WAL')
+    db.executescript(SCHEMA)
+    return db
+
+
+# Bring the index of games_dir up to date, return the number of games read
+def update_index(db: sqlite3.Connection, games_dir: str, processes: typing.Optional[int] = None) -> int:
+    indexed = {path: (mtime_ns, size) for path, mtime_ns, size in db.execute('SELECT path, mtime_ns, size FROM games')}
+    current = {}
+    for path in game_paths(games_dir):
+        stat = os.stat(path)
+        current[path] = (stat.st_mtime_ns, stat.st_size)
+    gone = [path for path in indexed if path not in current]
+    changed = [path for path, version in current.items() if indexed.get(path) != version]
+    db.executemany('DELETE FROM games WHERE path = ?', [(path,) for path in gone + changed])
+    if len(changed) > 0:
+        with multiprocessing.Pool(processes) as pool:
+            for path, indexed_game in pool.imap_unordered(try_index_game, changed, chunksize=16):
+                if indexed_game is None:
+                    continue
+                row, turns = indexed_game
+                cursor = db.execute(
+                    f"INSERT INTO games (path, mtime_ns, size, {', '.join(GAME_COLUMNS)}) "
+                    f"VALUES (?, ?, ?, {', '.join('?' * len(GAME_COLUMNS))})",
+                    (path, *current[path], *(row[column] for column in GAME_COLUMNS))
+                )
+                db.executemany('INSERT OR REPLACE INTO turns VALUES (?, ?, ?, ?, ?)', [(cursor.lastrowid, *turn) for turn in turns])
+    db.commit()
+    return len(changed)
+
+
+# Given the parsed command line, return the SQL condition and parameters selecting the games
+def build_filter(args: argparse.Namespace) -> typing.Tuple[str, typing.List]:
+    conditions = ['finished = 1'] if not args.unfinished else []
+    params = []
+    for column, value in (
+        ('ruleset', args.ruleset), ('snake_count', args.snakes), ('width', args.width),
+        ('height', args.height), ('death_cause', args.death_cause),
+    ):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    if args.won:
+        conditions.append('won = 1')
+    if args.lost:
+        conditions.append('won = 0')
+    if args.min_turns is not None:
+        conditions.append('our_turns >= ?')
+        params.append(args.min_turns)
+    if args.max_turns is not None:
+        conditions.append('our_turns <= ?')
+        params.append(args.max_turns)
+    if args.min_length is not None:
+        conditions.append('our_length >= ?')
+        params.append(args.min_length)
+    if args.where is not None:
+        conditions.append(f"({args.where})")
+    return ' AND '.join(conditions) or '1', params
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-g', '--games_dir', default='games',
+                        help='Directory of games saved by sl_snake.py --save_games. Default games.')
+    parser.add_argument('-i', '--index', default=None,
+                        help=f'Index file. Default {INDEX_FILE} in the games directory.')
+    parser.add_argument('-p', '--processes', default=None, type=int,
+                        help='Number of worker processes reading new games. Default one per core.')
+    parser.add_argument('--no_update', action='store_true',
+                        help='Query the index as it is, without looking for new games')
+    parser.add_argument('--ruleset', default=None,
+                        help='Only games of this ruleset, e.g. standard')
+    parser.add_argument('--snakes', default=None, type=int,
+                        help='Only games started by this many snakes')
+    parser.add_argument('--width', default=None, type=int,
+                        help='Only games on boards this wide')
+    parser.add_argument('--height', default=None, type=int,
+                        help='Only games on boards this high')
+    parser.add_argument('--won', action='store_true',
+                        help='Only games our snake won')
+    parser.add_argument('--lost', action='store_true',
+                        help='Only games our snake did not win')
+    parser.add_argument('--death_cause', default=None,
+                        help=f'Only games our snake died of this, e.g. head-collision or {UNKNOWN_CAUSE}')
+    parser.add_argument('--min_turns', default=None, type=int,
+                        help='Only games our snake survived at least this many turns')
+    parser.add_argument('--max_turns', default=None, type=int,
+                        help='Only games our snake survived at most this many turns')
+    parser.add_argument('--min_length', default=None, type=int,
+                        help='Only games our snake grew at least this long')
+    parser.add_argument('--unfinished', action='store_true',
+                        help='Include games recorded without an end')
+    parser.add_argument('--where', default=None,
+                        help='Extra SQL condition on the games table, '
+                             'e.g. "id IN (SELECT game FROM turns WHERE our_health < 10)"')
+    parser.add_argument('--limit', default=None, type=int,
+                        help='Select at most this many games')
+    parser.add_argument('-c', '--count', action='store_true',
+                        help='Print the number of matching games instead of their paths')
+    parser.add_argument('--link', default=None,
+                        help='Directory to fill with links to the matching games')
+    args = parser.parse_args()
+
+    db = open_index(args.index or os.path.join(args.games_dir, INDEX_FILE))
+    if not args.no_update:
+        start = time.perf_counter()
+        updated = update_index(db, args.games_dir, args.processes)
+        if updated > 0:
+            print(f"Indexed {updated} games in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+
+    condition, params = build_filter(args)
+    query = f"SELECT path FROM games WHERE {condition} ORDER BY path"
+    if args.limit is not None:
+        query += f" LIMIT {int(args.limit)}"
+    start = time.perf_counter()
+    paths = [path for path, in db.execute(query, params)]
+    print(f"{len(paths)} games match, queried in {(time.perf_counter() - start) * 1000:.1f} ms", file=sys.stderr)
+    if args.count:
+        print(len(paths))
+    elif args.link is not None:
+        os.makedirs(args.link, exist_ok=True)
+        for path in paths:
+            link = os.path.join(args.link, os.path.basename(path))
+            if not os.path.lexists(link):
+                os.symlink(os.path.abspath(path), link)
+    else:
+        for path in paths:
+            print(path)
@@ -0,0 +1,442 @@
+# Compact binary records of played games, written by sl_snake.py --save_games.
+#
+# A record file holds a header followed by one record per turn, all little endian:
+#   header: b'BSGR', version u8, width u8, height u8, timeout u16, snake count u8,
+#           index of the recording snake u8, game id str, ruleset name str,
+#           then id str and name str of every snake. str is a u8 byte length and utf-8
+#   turn:   tag u8 (TURN, or END for the final state), turn u16, then for every snake:
+#             kind u8 (ABSENT once eliminated, MOVED or FULL)
+#             health u8, action u8 (index in ACTIONS of the move that led here, NO_ACTION
+#             if unknown), length u16, then the new head cell u16 if MOVED or every
+#             body cell u16 if FULL
+#           then the cells u16 added to and removed from the food, and from the hazards,
+#           each as a u16 count and the cells
+#   end:    after the END turn, the index of the winner i8, -1 if there is none, and the
+#           index in ACTIONS of the recording snake's last move u8, NO_ACTION if unknown
+#           (version 1 records end after the winner)
+# Cells are y * width + x. MOVED bodies are the previous body moved to the new head
+# the way the rules move snakes, so most turns store a few bytes per snake.
+#
+# GameRecorder encodes and writes the records on a background thread, so move() never
+# waits on the file, and drops games rather than block when it falls behind.
+# read_game reads a record back as the game states the snake was sent, and also reads
+# the JSON files older versions of sl_snake.py saved.
+
+import atexit
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import typing
+
+import metrics
+
+MAGIC = b'BSGR'
+VERSION = 2
+RECORD_EXTENSION = '.bsg'
+TURN = 1
+END = 2
+ABSENT = 0
+MOVED = 1
+FULL = 2
+ACTIONS = ('up', 'down', 'left', 'right')
+NO_ACTION = 255
+# Bytes buffered for a game before they are appended to its file
+FLUSH_BYTES = 64 * 1024
+# Game states GameRecorder holds before it drops new ones
+QUEUE_SIZE = 4096
+# Game states the writer thread encodes between writes
+BATCH_SIZE = 256
+# Seconds after its last state an unfinished game is forgotten
+STALE_SECONDS = 600
+# Seconds close waits for the queue to be written
+CLOSE_TIMEOUT = 3
+
+
+def pack_str(value: str) -> bytes:
+    data = value.encode()[:255]
+    return struct.pack('<B', len(data)) + data
+
+
+def pack_cells(cells: typing.List[int]) -> bytes:
+    return struct.pack(f'<H{len(cells)}H', len(cells), *cells)
+
+
+# Given two points, return the index in ACTIONS of the move from the first to the second
+def action_index(from_pos: typing.Dict, to_pos: typing.Dict) -> int:
+    if to_pos['y'] > from_pos['y']:
+        return 0
+    elif to_pos['y'] < from_pos['y']:
+        return 1
+    elif to_pos['x'] < from_pos['x']:
+        return 2
+    elif to_pos['x'] > from_pos['x']:
+        return 3
+    return NO_ACTION
+
+
+# Encodes the states of one game, each turn as the changes from the turn before
+class RecordEncoder:
+    def __init__(self, game_state: typing.Dict):
+        self.width = game_state['board']['width']
+        self.snakes = [snake['id'] for snake in game_state['board']['snakes']]
+        self.you = self.snakes.index(game_state['you']['id'])
+        self.header = MAGIC + struct.pack(
+            '<BBBHBB', VERSION, self.width, game_state['board']['height'],
+            game_state['game'].get('timeout', 500), len(self.snakes), self.you
+        ) + pack_str(game_state['game']['id']) + pack_str(game_state['game']['ruleset']['name'])
+        for snake in game_state['board']['snakes']:
+            self.header += pack_str(snake['id']) + pack_str(snake.get('name', ''))
+        # Indexed as bodies[snake id] = cells of the last encoded body
+        self.bodies = {}
+        self.food = set()
+        self.hazards = set()
+        self.ended = False
+        self.last_move = NO_ACTION
+
+    def cells(self, points: typing.List[typing.Dict]) -> typing.List[int]:
+        return [point['y'] * self.width + point['x'] for point in points]
+
+    # Return the record of a turn's game state, move is the recording snake's answer to it
+    def turn(self, game_state: typing.Dict, tag: int = TURN, move: typing.Optional[str] = None) -> bytes:
+        if move in ACTIONS:
+            self.last_move = ACTIONS.index(move)
+        parts = [struct.pack('<BH', tag, game_state['turn'])]
+        snakes = {snake['id']: snake for snake in game_state['board']['snakes']}
+        bodies = {}
+        for snake_id in self.snakes:
+            if snake_id not in snakes:
+                parts.append(struct.pack('<B', ABSENT))
+                continue
+            snake = snakes[snake_id]
+            body = self.cells(snake['body'])
+            bodies[snake_id] = body
+            action = action_index(snake['body'][1], snake['head']) if len(body) > 1 else NO_ACTION
+            if move_body(self.bodies.get(snake_id), body[0], len(body)) == body:
+                parts.append(struct.pack('<BBBHH', MOVED, snake['health'], action, len(body), body[0]))
+            else:
+                parts.append(struct.pack(f'<BBBH{len(body)}H', FULL, snake['health'], action, len(body), *body))
+        self.bodies = bodies
+        for attr, key in (('food', 'food'), ('hazards', 'hazards')):
+            cells = set(self.cells(game_state['board'].get(key, [])))
+            previous = getattr(self, attr)
+            parts.append(pack_cells(sorted(cells - previous)) + pack_cells(sorted(previous - cells)))
+            setattr(self, attr, cells)
+        return b''.join(parts)
+
+    # Return the record of the game's final state and its winner, the first snake left
+    # like the JSON files had
+    def end(self, game_state: typing.Dict) -> bytes:
+        snakes = game_state['board']['snakes']
+        winner = self.snakes.index(snakes[0]['id']) if len(snakes) > 0 and snakes[0]['id'] in self.snakes else -1
+        self.ended = True
+        return self.turn(game_state, END) + struct.pack('<bB', winner, self.last_move)
+
+
+# Given a body, return it moved to head and grown to length the way the rules move snakes
+def move_body(body: typing.Optional[typing.List[int]], head: int, length: int) -> typing.Optional[typing.List[int]]:
+    if body is None:
+        return None
+    moved = [head] + body[:-1]
+    while len(moved) < length:
+        moved.append(moved[-1])
+    return moved[:length]
+
+
+# Reads a record file back
+class RecordDecoder:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.offset = 0
+
+    def read(self, fmt: str) -> typing.Tuple:
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def read_str(self) -> str:
+        length, = self.read('<B')
+        self.offset += length
+        return self.data[self.offset - length:self.offset].decode()
+
+    def read_cells(self) -> typing.List[int]:
+        count, = self.read('<H')
+        return list(self.read(f'<{count}H'))
+
+
+# Given the path of a game saved by sl_snake.py, return its game states in turn order,
+# the actions[snake id] each snake took after each state (empty when the next turn
+# wasn't recorded), the id of the winner ('' if none), the id of the recording snake,
+# its last move (None if unknown) and the final state
+def read_game(path: str) -> typing.Dict:
+    if path.endswith('.json'):
+        return read_json_game(path)
+    with open(path, 'rb') as fp:
+        decoder = RecordDecoder(fp.read())
+    if decoder.read('<4s')[0] != MAGIC:
+        raise Exception(f"{path} is not a game record")
+    version, width, height, timeout, snake_count, you = decoder.read('<BBBHBB')
+    if version not in (1, VERSION):
+        raise Exception(f"{path} has record version {version}, expected {VERSION}")
+    game = {
+        'id': decoder.read_str(),
+        'ruleset': {'name': decoder.read_str(), 'version': ''},
+        'timeout': timeout,
+    }
+    snakes = [(decoder.read_str(), decoder.read_str()) for _ in range(snake_count)]
+
+    states = []
+    actions = []
+    winner = ''
+    last_move = None
+    final_state = None
+    bodies = {}
+    food = set()
+    hazards = set()
+    while decoder.offset < len(decoder.data):
+        tag, turn = decoder.read('<BH')
+        board_snakes = []
+        turn_actions = {}
+        for snake_id, name in snakes:
+            kind, = decoder.read('<B')
+            if kind == ABSENT:
+                bodies.pop(snake_id, None)
+                continue
+            health, action, length = decoder.read('<BBH')
+            if kind == MOVED:
+                head, = decoder.read('<H')
+                bodies[snake_id] = move_body(bodies[snake_id], head, length)
+            else:
+                bodies[snake_id] = list(decoder.read(f'<{length}H'))
+            body = [{'x': cell % width, 'y': cell // width} for cell in bodies[snake_id]]
+            board_snakes.append({
+                'id': snake_id, 'name': name, 'health': health, 'body': body,
+                'head': body[0], 'length': length,
+            })
+            if action != NO_ACTION:
+                turn_actions[snake_id] = ACTIONS[action]
+        food = (food | set(decoder.read_cells())) - set(decoder.read_cells())
+        hazards = (hazards | set(decoder.read_cells())) - set(decoder.read_cells())
+        # The actions that led to this state were taken after the previous one, unless
+        # turns in between weren't recorded, like moves the watchdog answered for the
+        # snake. Then the previous state gets no actions rather than wrong ones
+        if len(states) > 0:
+            actions.append(turn_actions if turn == states[-1]['turn'] + 1 else {})
+        state = {
+            'game': game,
+            'turn': turn,
+            'board': {
+                'height': height,
+                'width': width,
+                'food': [{'x': cell % width, 'y': cell // width} for cell in sorted(food)],
+                'hazards': [{'x': cell % width, 'y': cell // width} for cell in sorted(hazards)],
+                'snakes': board_snakes,
+            },
+            'you': next((snake for snake in board_snakes if snake['id'] == snakes[you][0]), None),
+        }
+        if tag == END:
+            final_state = state
+            winner_index, = decoder.read('<b')
+            winner = snakes[winner_index][0] if winner_index >= 0 else ''
+            if version > 1:
+                move_index, = decoder.read('<B')
+                last_move = ACTIONS[move_index] if move_index != NO_ACTION else None
+            break
+        states.append(state)
+    return {
+        'states': states, 'actions': actions, 'winner': winner, 'you': snakes[you][0],
+        'last_move': last_move, 'final_state': final_state,
+    }
+
+
+# Read a game the way read_game does, from the JSON lines of older versions of sl_snake.py
+def read_json_game(path: str) -> typing.Dict:
+    states = []
+    actions = []
+    winner = ''
+    winner_found = False
+    with open(path) as game_data:
+        for line in game_data:
+            line_dict = json.loads(line)
+            if 'game' in line_dict:
+                states.append(line_dict)
+            elif 'winner' in line_dict:
+                winner = line_dict['winner']
+                winner_found = True
+            else:
+                actions.append(line_dict)
+    # The final state isn't saved, the actions after the last state tell who is in it
+    final_state = None
+    if winner_found and len(states) > 0:
+        final_state = {'board': {'snakes': [{'id': snake_id} for snake_id in actions[-1]]}}
+    return {
+        'states': states, 'actions': actions, 'winner': winner,
+        'you': states[0]['you']['id'] if len(states) > 0 else '', 'last_move': None, 'final_state': final_state,
+    }
+
+
+# Return the paths of the saved games in games_dir, in either format
+def game_paths(games_dir: str) -> typing.List[str]:
+    return sorted(
+        entry.path
+        for entry in os.scandir(games_dir)
+        if entry.is_file() and entry.name.endswith((RECORD_EXTENSION, '.json'))
+    )
+
+
+# Records games to games_dir without ever making the request thread wait. Game states
+# go into a bounded queue, and a background thread takes them out in batches, encodes
+# them and appends each game's records to its file once the game ends, or once
+# FLUSH_BYTES are buffered, so a batch costs at most one write per game. When a burst
+# fills the queue, the state is dropped rather than waited on, and since a record with
+# a missing turn would pair states with the wrong actions, the rest of that game is
+# dropped too. Drops and the queue depth are reported by metrics
+class GameRecorder:
+    def __init__(self, games_dir: str, queue_size: int = QUEUE_SIZE):
+        self.games_dir = games_dir
+        self.queue = queue.Queue(queue_size)
+        # Indexed as recording[game id] = id of the snake whose states are recorded,
+        # so a game played by several of our snakes is recorded once
+        self.recording = {}
+        # Indexed as abandoned[game id] = time the game was dropped
+        self.abandoned = {}
+        # Indexed as encoders[game id] = [encoder, buffered bytes, time of the last state],
+        # used by the writer thread only
+        self.encoders = {}
+        # Ids of the abandoned games the writer thread has removed
+        self.discarded = set()
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def start(self, game_state: typing.Dict):
+        if self.recording.setdefault(game_state['game']['id'], game_state['you']['id']) == game_state['you']['id']:
+            self._put('start', game_state)
+
+    # Record a game state and the move the snake answered
+    def record(self, game_state: typing.Dict, move: typing.Optional[str] = None):
+        if self.recording.get(game_state['game']['id']) == game_state['you']['id']:
+            self._put('turn', game_state, move)
+
+    def end(self, game_state: typing.Dict):
+        game_id = game_state['game']['id']
+        if game_id in self.recording and self.recording[game_id] is None:
+            del self.recording[game_id]
+        elif self.recording.get(game_id) == game_state['you']['id']:
+            del self.recording[game_id]
+            self._put('end', game_state)
+
+    # Wait up to timeout seconds for every queued game state to be written
+    def close(self, timeout: float = CLOSE_TIMEOUT):
+        if self.thread is None or self.pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks > 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _put(self, kind: str, game_state: typing.Dict, move: typing.Optional[str] = None):
+        # Worker processes are forked without the parent's thread, start one in each process
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    os.makedirs(self.games_dir, exist_ok=True)
+                    self.queue = queue.Queue(self.queue.maxsize)
+                    self.thread = threading.Thread(target=self._run, daemon=True)
+                    self.thread.start()
+                    self.pid = os.getpid()
+        try:
+            self.queue.put_nowait((kind, game_state, move))
+        except queue.Full:
+            game_id = game_state['game']['id']
+            metrics.count('recorder_dropped_states')
+            if game_id not in self.abandoned:
+                metrics.count('recorder_dropped_games')
+                self.abandoned[game_id] = time.monotonic()
+            # Stop recording the game until its end
+            if kind != 'end':
+                self.recording[game_id] = None
+        metrics.set_gauge('recorder_queue_depth', self.queue.qsize())
+
+    def _run(self):
+        last_check = time.monotonic()
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception as error:
+                print(f"Failed to record games: {error!r}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            metrics.set_gauge('recorder_queue_depth', self.queue.qsize())
+            if time.monotonic() - last_check > STALE_SECONDS / 10:
+                self._drop_stale()
+                last_check = time.monotonic()
+
+    # Encode a batch of game states and write the games that ended or buffered enough
+    def _write_batch(self, batch: typing.List[typing.Tuple[str, typing.Dict, typing.Optional[str]]]):
+        ready = set()
+        for kind, game_state, move in batch:
+            game_id = game_state['game']['id']
+            if game_id in self.abandoned:
+                continue
+            if kind == 'start':
+                encoder = RecordEncoder(game_state)
+                self.encoders[game_id] = [encoder, bytearray(encoder.header), time.monotonic()]
+                continue
+            if game_id not in self.encoders:
+                continue
+            entry = self.encoders[game_id]
+            entry[2] = time.monotonic()
+            if kind == 'turn':
+                entry[1] += entry[0].turn(game_state, move=move)
+                if len(entry[1]) >= FLUSH_BYTES:
+                    ready.add(game_id)
+            else:
+                entry[1] += entry[0].end(game_state)
+                ready.add(game_id)
+        for game_id in ready:
+            if game_id not in self.encoders:
+                continue
+            encoder, buffer, _ = self.encoders[game_id]
+            with open(self.path(game_id), 'ab') as fp:
+                fp.write(buffer)
+            metrics.count('recorder_bytes_written', len(buffer))
+            buffer.clear()
+            if encoder.ended:
+                del self.encoders[game_id]
+        # The queue was full when a game was dropped, so this runs after every drop
+        # even if none of the game's states are left in the queue
+        for game_id in list(self.abandoned):
+            if game_id not in self.discarded:
+                self._discard(game_id)
+                self.discarded.add(game_id)
+
+    def path(self, game_id: str) -> str:
+        return os.path.join(self.games_dir, game_id + RECORD_EXTENSION)
+
+    # Forget a game and remove what was written of it
+    def _discard(self, game_id: str):
+        self.encoders.pop(game_id, None)
+        if os.path.exists(self.path(game_id)):
+            os.remove(self.path(game_id))
+
+    # Forget games that stopped sending states without an end, like games the engine
+    # gave up on, and dropped games old enough to have left the queue
+    def _drop_stale(self):
+        now = time.monotonic()
+        for game_id, (_, _, last_state) in list(self.encoders.items()):
+            if now - last_state > STALE_SECONDS:
+                self._discard(game_id)
+        for game_id, dropped in list(self.abandoned.items()):
+            if now - dropped > STALE_SECONDS:
+                self.discarded.discard(game_id)
+                del self.abandoned[game_id]
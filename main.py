@@ -14,6 +14,9 @@ import argparse
 import random
 import typing
 
+import metrics
+from board import BoardTracker, avoid_walls, avoid_snake_bodies
+
 parser = argparse.ArgumentParser()
 parser.add_argument('-c', '--color',
 default=random.choice(["#DFFF00","#FFBF00","#FF7F50","#DE3163","#9FE2BF","#40E0D0","#6495ED","#CCCCFF"]),
@@ -22,6 +25,16 @@ parser.add_argument('-p', '--port', default='8001',
 help='Port to run Battlesnake on. Default 8001.')
 parser.add_argument('-d', '--deployed', action='store_true',
 help='Opens server to the internet')
+parser.add_argument('-w', '--workers', default=0, type=int,
+help='Number of worker processes serving games. Default 0 runs the single process development server.')
+parser.add_argument('--keep_alive', default=5, type=int,
+help='Seconds an idle connection is kept open when running with workers. Default 5.')
+parser.add_argument('--graceful_timeout', default=10, type=int,
+help='Seconds to finish requests in flight on SIGTERM when running with workers. Default 10.')
+parser.add_argument('--watchdog_margin', default=50, type=int,
+help='Milliseconds before the move timeout at which the best move found so far is sent. Default 50.')
+parser.add_argument('--threads', default=32, type=int,
+help='Threads answering requests with workers, at least the number of games played at once. Default 32.')
 parser.add_argument('--print_level', default=2, type=int, choices=[1,2,3],
     help='''1: silence all prints
             2: (Default) silence move(), info(), start()
@@ -38,7 +51,7 @@ stats = {
     'turns': []
 }
 # To handle multiple instance of this snake in the same game
-# Indexed as ongoing_games[game_id][snake_id] = [body_length, turns_survived]
+# Indexed as ongoing_games[game_id][snake_id] = [body_length, turns_survived, board_tracker]
 ongoing_games = {}
 
 
@@ -61,68 +74,9 @@ def start(game_state: typing.Dict):
     global ongoing_games
     if game_state['game']['id'] not in ongoing_games:
         ongoing_games[game_state['game']['id']] = {}
-    ongoing_games[game_state['game']['id']][game_state['you']['id']] = [len(game_state['you']['body']), 0]
-
-
-# Given a game state, perform common preprocessing and return results
-def preprocess(game_state: typing.Dict):
-    # Create obstacles array storing each body part's expected lifetime
-    obstacles = [
-        [0] * game_state['board']['height']
-        for x in range(game_state['board']['width'])
+    ongoing_games[game_state['game']['id']][game_state['you']['id']] = [
+        len(game_state['you']['body']), 0, BoardTracker()
     ]
-    for snake in game_state['board']['snakes']:
-        snake_length = len(snake['body'])
-        for i, body_part in enumerate(snake['body'][:-1]):
-            # Store distance of body part to it's own tail
-            # If snake just ate, tail pos is 1 otherwise it is 0
-            obstacles[body_part['x']][body_part['y']] = snake_length - (i + 1)
-    return obstacles
-
-# Given head position and direction, return the new head position
-def get_move_position(head: typing.Dict, direction: str)-> typing.Dict:
-    if direction not in ['up', 'down', 'left', 'right']:
-        raise Exception('Invalid direction')
-    if direction == 'up':
-        return {'y': head['y']+1, 'x': head['x']}
-    elif direction == 'down':
-        return {'y': head['y']-1, 'x': head['x']}
-    elif direction == 'left':
-        return {'x': head['x']-1, 'y': head['y']}
-    else:
-        return {'x': head['x']+1, 'y': head['y']}
-
-
-# Given game state, head position, and current move risks, determines fatal out-of-bounds moves
-# returns updated move risks
-def avoid_walls(game_state: typing.Dict, head_pos: typing.Dict, danger_risk: typing.Dict) -> typing.Dict:
-    # Left wall is at x = -1, don't go there
-    if head_pos['x'] == 0:
-        danger_risk['left'] += 1
-    # Right wall is at x = board_width, don't go there
-    elif head_pos['x'] == game_state['board']['width']-1:
-        danger_risk['right'] += 1
-    # Bottom wall is at y = -1, don't go there
-    if head_pos['y'] == 0:
-        danger_risk['down'] += 1
-    # Top wall is at y = board_height, don't go there
-    elif head_pos['y'] == game_state['board']['height']-1:
-        danger_risk['up'] += 1
-    return danger_risk
-
-
-# Given obstacles array, head position & current move risk, determines moves that will be fatal colision
-# with any snake body. Returns updated move risk.
-def avoid_snake_bodies(obstacles: list, head_pos: typing.Dict, danger_risk: typing.Dict) -> typing.Dict:
-    for move in danger_risk:
-        mov_pos = get_move_position(head_pos, move)
-        # Ensure that move is in bounds
-        if mov_pos['x'] >= 0 and mov_pos['x'] < len(obstacles):
-            if mov_pos['y'] >= 0 and mov_pos['y'] < len(obstacles[0]):
-                # If an obstacle is at move position, add 1 to risk
-                if obstacles[mov_pos['x']][mov_pos['y']] > 0:
-                    danger_risk[move] += 1
-    return danger_risk
 
 
 # move is called on every turn and returns your next move
@@ -130,23 +84,26 @@ def avoid_snake_bodies(obstacles: list, head_pos: typing.Dict, danger_risk: typi
 # See https://docs.battlesnake.com/api/example-move for available data
 def move(game_state: typing.Dict) -> typing.Dict:
     global ongoing_games
-    ongoing_games[game_state['game']['id']][game_state['you']['id']] = [
-        len(game_state['you']['body']),
-        game_state['turn']
-    ]
+    game_info = ongoing_games[game_state['game']['id']][game_state['you']['id']]
+    game_info[0] = len(game_state['you']['body'])
+    game_info[1] = game_state['turn']
+    tracker = game_info[2]
     
     # Perform pre-processing
-    obstacles = preprocess(game_state)
+    with metrics.phase('preprocess'):
+        board = tracker.update(game_state)
 
     directions = ["up", "down", "left", "right"]
     danger_risk = {"up": 0.0, "down": 0.0, "left": 0.0, "right": 0.0}
-    my_head = game_state['you']['head']
+    my_head = board.head(board.you)
 
     # Avoid hitting the walls
-    danger_risk = avoid_walls(game_state, my_head, danger_risk)
+    with metrics.phase('avoid_walls'):
+        danger_risk = avoid_walls(board, my_head, danger_risk)
 
     # Avoid hitting snakes
-    danger_risk = avoid_snake_bodies(obstacles, my_head, danger_risk)
+    with metrics.phase('avoid_snake_bodies'):
+        danger_risk = avoid_snake_bodies(board, my_head, danger_risk)
 
     # Get lowest risk value
     min_risk = min(danger_risk.values())
@@ -171,7 +128,7 @@ def end(game_state: typing.Dict):
     print("GAME OVER\n")
     global ongoing_games
     stats['games'] += 1
-    max_len, turns_survived = ongoing_games[game_state['game']['id']][game_state['you']['id']]
+    max_len, turns_survived, _ = ongoing_games[game_state['game']['id']][game_state['you']['id']]
     stats['sizes'].append(max_len)
     stats['turns'].append(turns_survived)
     del ongoing_games[game_state['game']['id']][game_state['you']['id']]
@@ -196,4 +153,7 @@ def end(game_state: typing.Dict):
 if __name__ == "__main__":
     from server import run_server
 
-    run_server({"info": info, "start": start, "move": move, "end": end}, args.port, args.deployed)
+    run_server(
+        {"info": info, "start": start, "move": move, "end": end, "stats": lambda: stats}, args.port, args.deployed,
+        args.workers, args.keep_alive, args.graceful_timeout, args.watchdog_margin, args.threads
+    )
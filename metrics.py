@@ -0,0 +1,155 @@
+# Latency histograms and counters for the request path, rendered in the Prometheus text format.
+#
+# Each process keeps its own histograms. When the server runs with workers,
+# /metrics collects every worker's snapshot and adds them up.
+
+import bisect
+import contextlib
+import time
+import typing
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# Metric families and the label their histograms are keyed by
+FAMILIES = {
+    'request_seconds': ('endpoint', 'Time to answer a request, by endpoint'),
+    'phase_seconds': ('phase', 'Time spent in each phase of move(), by phase'),
+}
+# Descriptions of the counters
+COUNTERS = {
+    'late_moves': 'Moves answered by the watchdog because the strategy ran past the deadline',
+    'recorder_dropped_states': 'Game states not recorded because the recorder queue was full',
+    'recorder_dropped_games': 'Games left unrecorded because one of their states was dropped',
+    'recorder_bytes_written': 'Bytes of game records written',
+}
+# Descriptions of the gauges, which add up across workers
+GAUGES = {
+    'recorder_queue_depth': 'Game states waiting to be recorded',
+}
+
+
+class Histogram:
+    def __init__(self):
+        # One count per bucket plus one for values above the last bucket
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+
+    def merge(self, counts: typing.List[int], total: float):
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+        self.total += total
+
+
+# Indexed as histograms[(family, label)]
+histograms = {}
+counters = {name: 0 for name in COUNTERS}
+gauges = {name: 0 for name in GAUGES}
+
+
+def observe(family: str, label: str, seconds: float):
+    key = (family, label)
+    if key not in histograms:
+        histograms[key] = Histogram()
+    histograms[key].observe(seconds)
+
+
+def count(name: str, amount: int = 1):
+    counters[name] += amount
+
+
+def set_gauge(name: str, value: float):
+    gauges[name] = value
+
+
+# Time the body of a with statement as one phase of move()
+@contextlib.contextmanager
+def phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe('phase_seconds', name, time.perf_counter() - start)
+
+
+# Return this process's histograms in a form that can be sent between processes
+def snapshot() -> typing.Dict:
+    return {
+        'histograms': {key: (histogram.counts, histogram.total) for key, histogram in histograms.items()},
+        'counters': dict(counters),
+        'gauges': dict(gauges),
+    }
+
+
+# Add up several snapshots into histograms, counters and gauges
+def merge_snapshots(snapshots: typing.List[typing.Dict]) -> typing.Tuple[
+        typing.Dict[typing.Tuple[str, str], Histogram], typing.Dict[str, int], typing.Dict[str, float]]:
+    merged = {}
+    merged_counters = {name: 0 for name in COUNTERS}
+    merged_gauges = {name: 0 for name in GAUGES}
+    for snap in snapshots:
+        for key, (counts, total) in snap['histograms'].items():
+            if key not in merged:
+                merged[key] = Histogram()
+            merged[key].merge(counts, total)
+        for name, value in snap['counters'].items():
+            merged_counters[name] += value
+        for name, value in snap['gauges'].items():
+            merged_gauges[name] += value
+    return merged, merged_counters, merged_gauges
+
+
+# Add up the stats dicts kept by the snakes
+def merge_stats(stats_list: typing.List[typing.Dict]) -> typing.Dict:
+    merged = {'games': 0, 'wins': 0, 'losses': 0, 'sizes': [], 'turns': []}
+    for stats in stats_list:
+        for key in ('games', 'wins', 'losses'):
+            merged[key] += stats[key]
+        merged['sizes'].extend(stats['sizes'])
+        merged['turns'].extend(stats['turns'])
+    return merged
+
+
+# Render histograms, counters, gauges and game stats in the Prometheus text format
+def render(merged: typing.Dict[typing.Tuple[str, str], Histogram], merged_counters: typing.Dict[str, int],
+           merged_gauges: typing.Dict[str, float], stats: typing.Dict) -> str:
+    lines = []
+    for family, (label, description) in FAMILIES.items():
+        name = f"battlesnake_{family}"
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} histogram")
+        for (key_family, value), histogram in sorted(merged.items()):
+            if key_family != family:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{label}="{value}",le="{bound}"}} {cumulative}')
+            cumulative += histogram.counts[-1]
+            lines.append(f'{name}_bucket{{{label}="{value}",le="+Inf"}} {cumulative}')
+            lines.append(f'{name}_sum{{{label}="{value}"}} {histogram.total}')
+            lines.append(f'{name}_count{{{label}="{value}"}} {cumulative}')
+    for name, description in COUNTERS.items():
+        lines.append(f"# HELP battlesnake_{name}_total {description}")
+        lines.append(f"# TYPE battlesnake_{name}_total counter")
+        lines.append(f"battlesnake_{name}_total {merged_counters[name]}")
+    for name, description in GAUGES.items():
+        lines.append(f"# HELP battlesnake_{name} {description}")
+        lines.append(f"# TYPE battlesnake_{name} gauge")
+        lines.append(f"battlesnake_{name} {merged_gauges[name]}")
+    for key, description in (('games', 'Games finished'), ('wins', 'Games won'), ('losses', 'Games lost')):
+        lines.append(f"# HELP battlesnake_{key}_total {description}")
+        lines.append(f"# TYPE battlesnake_{key}_total counter")
+        lines.append(f"battlesnake_{key}_total {stats[key]}")
+    for key, name, description in (
+        ('sizes', 'max_body_size', 'Longest body reached in each game'),
+        ('turns', 'turns_survived', 'Turns survived in each game'),
+    ):
+        lines.append(f"# HELP battlesnake_{name} {description}")
+        lines.append(f"# TYPE battlesnake_{name} summary")
+        lines.append(f"battlesnake_{name}_sum {sum(stats[key])}")
+        lines.append(f"battlesnake_{name}_count {len(stats[key])}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,117 @@
+# Answers /move before the game's timeout even when a strategy runs long.
+#
+# The move handler runs in its own thread while the request waits until
+# game.timeout minus a margin after the request arrived. The server sets that
+# deadline on arrival, so time spent waiting for a busy worker counts against it.
+# If the handler hasn't returned by then, the request answers with the last move
+# the handler published with publish_move, or with the safest move by
+# avoid_walls/avoid_snake_bodies if it published none. Handlers time themselves
+# with move_deadline, so they stop once the request has been answered.
+# A move that runs late keeps its game busy, and the next moves of that game
+# answer with the fallback until it finishes, so a game's state is never
+# updated by two moves at once.
+
+import random
+import threading
+import time
+import traceback
+import typing
+
+import metrics
+from board import Board, avoid_walls, avoid_snake_bodies
+
+# Holds the provisional move and the deadline of the move running in the current thread
+_current = threading.local()
+
+
+# Publish the best move found so far by the move running in this thread.
+# Does nothing outside a watched move
+def publish_move(move: str):
+    provisional = getattr(_current, 'provisional', None)
+    if provisional is not None:
+        provisional[0] = move
+
+
+# Given a game state and a margin in milliseconds, return the time.perf_counter() by
+# which the move should answer to leave margin of the game's timeout. In a watched move
+# the timeout is counted from the request's arrival, and the deadline is no later than
+# the watchdog's answer
+def move_deadline(game_state: typing.Dict, margin: int) -> float:
+    now = time.perf_counter()
+    watched = getattr(_current, 'deadline', None)
+    if watched is None:
+        return now + (game_state['game']['timeout'] - margin) / 1000
+    deadline, watchdog_margin = watched
+    left = min(deadline + (watchdog_margin - margin) / 1000, deadline) - time.monotonic()
+    return now + left
+
+
+# Given a game state, return a random move among the ones that avoid walls and bodies
+def fallback_move(game_state: typing.Dict) -> str:
+    board = Board.from_game_state(game_state)
+    danger_risk = {"up": 0.0, "down": 0.0, "left": 0.0, "right": 0.0}
+    my_head = board.head(board.you)
+    danger_risk = avoid_walls(board, my_head, danger_risk)
+    danger_risk = avoid_snake_bodies(board, my_head, danger_risk)
+    min_risk = min(danger_risk.values())
+    return random.choice([move for move in danger_risk if danger_risk[move] == min_risk])
+
+
+class MoveWatchdog:
+    def __init__(self, move_handler: typing.Callable, margin: int):
+        self.move_handler = move_handler
+        # Milliseconds of the game's timeout kept for the response to reach the game server
+        self.margin = margin
+        # Indexed as busy[(game id, snake id)] = event set when that game's running move ends
+        self.busy = {}
+        self.lock = threading.Lock()
+
+    # Answer a move by deadline, in time.monotonic() seconds. Without one, the deadline
+    # is counted from now
+    def __call__(self, game_state: typing.Dict, deadline: typing.Optional[float] = None) -> typing.Dict:
+        if deadline is None:
+            deadline = time.monotonic() + (game_state['game']['timeout'] - self.margin) / 1000
+        # Out of time already, like a move queued behind others, don't start the handler
+        if deadline <= time.monotonic():
+            metrics.count('late_moves')
+            return {"move": fallback_move(game_state)}
+        key = (game_state['game']['id'], game_state['you']['id'])
+        provisional = [None]
+        result = [None]
+        done = threading.Event()
+
+        # Wait for a late move of the same game to finish, then mark the game busy
+        while True:
+            with self.lock:
+                running = self.busy.get(key)
+                if running is None:
+                    self.busy[key] = done
+                    break
+            if not running.wait(max(deadline - time.monotonic(), 0)):
+                metrics.count('late_moves')
+                return {"move": fallback_move(game_state)}
+
+        def run():
+            _current.provisional = provisional
+            _current.deadline = (deadline, self.margin)
+            try:
+                result[0] = self.move_handler(game_state)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                _current.provisional = None
+                _current.deadline = None
+                with self.lock:
+                    if self.busy.get(key) is done:
+                        del self.busy[key]
+                done.set()
+
+        threading.Thread(target=run, daemon=True).start()
+        finished = done.wait(max(deadline - time.monotonic(), 0))
+        if finished and result[0] is not None:
+            return result[0]
+        if not finished:
+            metrics.count('late_moves')
+        if provisional[0] is not None:
+            return {"move": provisional[0]}
+        return {"move": fallback_move(game_state)}
@@ -1,77 +1,68 @@
 # This file parses battlesnake game data into a format that can be used for training a neural network.
+# Game files are parsed in parallel worker processes and the examples are written as
+# binary shards (see snakeSupervision/dataset.py), appended to the existing dataset.
 
-import json
-import os
+import argparse
+import functools
+import multiprocessing
+import typing
 
 import numpy as np
 
-trainingExamples = open('snakeSupervision/trainingExamples.json', 'a')
-trainingLabels = open('snakeSupervision/trainingLabels.json', 'a')
+from game_record import game_paths, read_game
+from snakeSupervision.dataset import SHARD_SIZE, ShardWriter
+from snakeSupervision.encoder import CHANNELS, INPUT_SIZE, add_symmetries, encode_example
 
-for i, filename in enumerate(os.scandir('games/')):
-    states_list = []
-    actions_list = []
-    winner = ''
-    with open(filename) as game_data:
-        next_line = game_data.readline()
-        while next_line:
-            line_dict = json.loads(next_line)
-            if 'game' in line_dict:
-                states_list.append(line_dict)
-            elif 'winner' in line_dict:
-                winner = line_dict['winner']
-            else:
-                actions_list.append(line_dict)
-            next_line = game_data.readline()
+
+# Given the path of a saved game, return its training examples, labels and board size,
+# with a copy of each example for every symmetry of the board if augment
+def parse_game(path: str, augment: bool = False
+               ) -> typing.Tuple[np.ndarray, np.ndarray, typing.Optional[typing.Tuple[int, int]]]:
+    game = read_game(path)
+    states_list = game['states']
+    actions_list = game['actions']
+    winner = game['winner']
     # For each state, actions pair create a training example for each snake as subject
     # Limit to last %10 of the game
     start_index = len(states_list) - len(states_list) // 10
-    for state, actions in zip(states_list[start_index:], actions_list[start_index:]):
-        board_width = state['board']['width']
-        board_height = state['board']['height']
-
+    pairs = list(zip(states_list[start_index:], actions_list[start_index:]))
+    count = sum(len(actions) for _, actions in pairs)
+    examples = np.zeros((count, INPUT_SIZE[0], INPUT_SIZE[1], CHANNELS), dtype=np.uint8)
+    labels = np.zeros(count, dtype=np.uint8)
+    i = 0
+    for state, actions in pairs:
         for subject_id, subject_action in actions.items():
-            # Transform game state into nn input arrays
-            subject_head = [[0 for _ in range(board_height)] for _ in range(board_width)]
-            subject_body = [[0 for _ in range(board_height)] for _ in range(board_width)]
-            heads_array = [[0 for _ in range(board_height)] for _ in range(board_width)]
-            bodies_array = [[0 for _ in range(board_height)] for _ in range(board_width)]
-            for snake in state['board']['snakes']:
-                if snake['id'] == subject_id:
-                    subject_head[snake['head']['x']][snake['head']['y']] = 1
-                    for part in snake['body'][1:]:
-                        subject_body[part['x']][part['y']] = 1
-                else:
-                    heads_array[snake['head']['x']][snake['head']['y']] = 1
-                    for part in snake['body'][1:]:
-                        bodies_array[part['x']][part['y']] = 1
-            
-            food_array = [[0 for _ in range(board_height)] for _ in range(board_width)]
-            for food in state['board']['food']:
-                food_array[food['x']][food['y']] = 1
+            examples[i] = encode_example(state, subject_id, subject_action)
+            labels[i] = subject_id == winner
+            i += 1
+    if len(pairs) == 0:
+        return examples, labels, None
+    size = (pairs[0][0]['board']['width'], pairs[0][0]['board']['height'])
+    if augment:
+        examples, labels = add_symmetries(examples, labels, *size)
+    return examples, labels, size
 
-            actions_array = [[0 for _ in range(board_height)] for _ in range(board_width)]
-            if subject_action == 'up':
-                actions_array[0][0] = 1
-            elif subject_action == 'down':
-                actions_array[0][1] = 1
-            elif subject_action == 'left':
-                actions_array[0][2] = 1
-            elif subject_action == 'right':
-                actions_array[0][3] = 1
 
-            final_array = [
-                subject_head, subject_body, heads_array, bodies_array, food_array, actions_array
-            ]
-            json.dump(final_array, trainingExamples)
-            trainingExamples.write('\n')
-            if subject_id == winner:
-                trainingLabels.write('1')
-            else:
-                trainingLabels.write('0')
-    
-    if i % 1000 == 0:
-        print(f'{i} games processed')
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-g', '--games_dir', default='games',
+                        help='Directory of games saved by sl_snake.py --save_games. Default games.')
+    parser.add_argument('-o', '--output', default='snakeSupervision/shards',
+                        help='Dataset directory the shards are added to. Default snakeSupervision/shards.')
+    parser.add_argument('-p', '--processes', default=None, type=int,
+                        help='Number of worker processes. Default one per core.')
+    parser.add_argument('--shard_size', default=SHARD_SIZE, type=int,
+                        help=f'Examples per shard. Default {SHARD_SIZE}.')
+    parser.add_argument('-a', '--augment', action='store_true',
+                        help='Also add every example turned and mirrored, 8 per example on square boards')
+    args = parser.parse_args()
 
-trainingExamples.close()
-trainingLabels.close()
\ No newline at end of file
+    paths = game_paths(args.games_dir)
+    writer = ShardWriter(args.output, args.shard_size)
+    parse = functools.partial(parse_game, augment=args.augment)
+    with multiprocessing.Pool(args.processes) as pool:
+        for i, (examples, labels, size) in enumerate(pool.imap(parse, paths, chunksize=4)):
+            writer.add(examples, labels, size)
+            if i % 1000 == 0:
+                print(f'{i} games processed')
+    writer.close()
@@ -0,0 +1,375 @@
+# In-process Battlesnake rules engine.
+#
+# Plays games by calling the snakes' start/move/end handlers directly instead of
+# driving them over HTTP with the battlesnake CLI. Follows the official rules of
+# the standard, solo, royale and wrapped game modes: every turn snakes move, lose
+# one health, take hazard damage, eat, get eliminated, then food spawns.
+#
+# Snake scripts parse their command line when imported, so load them with
+# load_snake, which gives each set of arguments its own copy of the module.
+
+import argparse
+import contextlib
+import importlib.util
+import os
+import random
+import shlex
+import sys
+import typing
+import uuid
+
+GAME_MODES = ('standard', 'solo', 'royale', 'wrapped')
+DIRECTIONS = {'up': (0, 1), 'down': (0, -1), 'left': (-1, 0), 'right': (1, 0)}
+# Ruleset settings the battlesnake CLI uses by default
+DEFAULT_SETTINGS = {
+    'foodSpawnChance': 15,
+    'minimumFood': 1,
+    'hazardDamagePerTurn': 14,
+    'royale': {'shrinkEveryNTurns': 25},
+}
+SNAKE_START_SIZE = 3
+SNAKE_MAX_HEALTH = 100
+
+# Elimination causes, as reported by the official rules
+OUT_OF_HEALTH = 'out-of-health'
+WALL_COLLISION = 'wall-collision'
+SELF_COLLISION = 'snake-self-collision'
+BODY_COLLISION = 'snake-collision'
+HEAD_COLLISION = 'head-collision'
+
+# Indexed as snake_modules[snake spec]
+snake_modules = {}
+
+
+# Given a snake spec like "sl_snake -m newConv_2.npz", return the snake's handlers.
+# The first word is the snake script, the rest are its command line arguments
+def load_snake(spec: str) -> typing.Dict[str, typing.Callable]:
+    if spec not in snake_modules:
+        script, *argv = shlex.split(spec)
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script + '.py')
+        module_spec = importlib.util.spec_from_file_location(f"snake_{len(snake_modules)}_{script}", path)
+        module = importlib.util.module_from_spec(module_spec)
+        saved_argv = sys.argv
+        sys.argv = [path] + argv
+        try:
+            module_spec.loader.exec_module(module)
+        finally:
+            sys.argv = saved_argv
+        snake_modules[spec] = module
+    module = snake_modules[spec]
+    return {"info": module.info, "start": module.start, "move": module.move, "end": module.end}
+
+
+class Snake:
+    def __init__(self, snake_id: str, name: str, handlers: typing.Dict, body: typing.List[typing.Tuple[int, int]]):
+        self.id = snake_id
+        self.name = name
+        self.handlers = handlers
+        # (x, y) of every body part, head first
+        self.body = body
+        self.health = SNAKE_MAX_HEALTH
+        self.eliminated_cause = None
+        self.eliminated_turn = None
+
+    # Return the direction the snake last moved in, "up" before its first move
+    def last_move(self) -> str:
+        if self.body[0] != self.body[1]:
+            dx = self.body[0][0] - self.body[1][0]
+            dy = self.body[0][1] - self.body[1][1]
+            for direction, delta in DIRECTIONS.items():
+                if delta == (dx, dy):
+                    return direction
+        return 'up'
+
+
+class Game:
+    def __init__(self, snakes: typing.List[typing.Tuple[str, typing.Dict]], game_mode: str = 'standard',
+                 width: int = 11, height: int = 11, seed: typing.Optional[int] = None, timeout: int = 500,
+                 settings: typing.Optional[typing.Dict] = None, max_turns: typing.Optional[int] = None):
+        if game_mode not in GAME_MODES:
+            raise Exception(f"Unknown game mode {game_mode}, expected one of {GAME_MODES}")
+        self.game_mode = game_mode
+        self.width = width
+        self.height = height
+        self.timeout = timeout
+        self.settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        self.max_turns = max_turns
+        self.rng = random.Random(seed)
+        self.id = str(uuid.UUID(int=self.rng.getrandbits(128)))
+        self.turn = 0
+        self.food = []
+        self.hazards = []
+        # Cells outside these bounds are hazards in royale games
+        self.safe_bounds = [0, width - 1, 0, height - 1]
+        self.snakes = [
+            Snake(str(uuid.UUID(int=self.rng.getrandbits(128))), name, handlers, [])
+            for name, handlers in snakes
+        ]
+        fixed = self._place_snakes()
+        self._place_initial_food(fixed)
+
+    # Put every snake on its start cell, return whether the standard start cells were used
+    def _place_snakes(self) -> bool:
+        fixed = self.width == self.height and self.width % 2 == 1 and self.width >= 7 and len(self.snakes) <= 8
+        if fixed:
+            low, mid, high = 1, (self.width - 1) // 2, self.width - 2
+            corners = [(low, low), (low, high), (high, low), (high, high)]
+            cardinals = [(low, mid), (mid, low), (mid, high), (high, mid)]
+            self.rng.shuffle(corners)
+            self.rng.shuffle(cardinals)
+            starts = corners + cardinals
+        else:
+            cells = [(x, y) for x in range(self.width) for y in range(self.height) if (x + y) % 2 == 0]
+            if len(cells) < len(self.snakes):
+                raise Exception(f"A {self.width}x{self.height} board has no room for {len(self.snakes)} snakes")
+            starts = self.rng.sample(cells, len(self.snakes))
+        for snake, start in zip(self.snakes, starts):
+            snake.body = [start] * SNAKE_START_SIZE
+        return fixed
+
+    # Put one food next to each snake and one in the centre, or at random cells on odd boards
+    def _place_initial_food(self, fixed: bool):
+        if not fixed:
+            for _ in self.snakes:
+                self._spawn_food(1)
+            return
+        center = ((self.width - 1) // 2, (self.height - 1) // 2)
+        heads = [snake.body[0] for snake in self.snakes]
+        for hx, hy in heads:
+            # Diagonal cells on the far side of the head from the centre
+            options = [
+                (fx, fy)
+                for fx, fy in ((hx - 1, hy - 1), (hx - 1, hy + 1), (hx + 1, hy - 1), (hx + 1, hy + 1))
+                if (fx, fy) != center and (fx, fy) not in self.food and (fx, fy) not in heads
+                and (fx < hx < center[0] or center[0] < hx < fx or fy < hy < center[1] or center[1] < hy < fy)
+            ]
+            if len(options) > 0:
+                self.food.append(self.rng.choice(options))
+        if center not in heads:
+            self.food.append(center)
+
+    # Add count food on random cells without snakes or food
+    def _spawn_food(self, count: int):
+        occupied = set(self.food)
+        for snake in self.snakes:
+            if snake.eliminated_cause is None:
+                occupied.update(snake.body)
+        free = [
+            (x, y)
+            for x in range(self.width)
+            for y in range(self.height)
+            if (x, y) not in occupied
+        ]
+        self.food.extend(self.rng.sample(free, min(count, len(free))))
+
+    def alive(self) -> typing.List[Snake]:
+        return [snake for snake in self.snakes if snake.eliminated_cause is None]
+
+    # Return the game state sent to snake, in the format of the battlesnake API.
+    # board_snakes can be passed to share the living snakes' dicts between snakes
+    def game_state(self, snake: Snake, board_snakes: typing.Optional[typing.List[typing.Dict]] = None) -> typing.Dict:
+        if board_snakes is None:
+            board_snakes = [self._snake_dict(other) for other in self.alive()]
+        you = next((other for other in board_snakes if other['id'] == snake.id), None)
+        return {
+            'game': {
+                'id': self.id,
+                'ruleset': {'name': self.game_mode, 'version': 'v1.2.3', 'settings': self.settings},
+                'map': 'royale' if self.game_mode == 'royale' else 'standard',
+                'timeout': self.timeout,
+                'source': 'custom',
+            },
+            'turn': self.turn,
+            'board': {
+                'height': self.height,
+                'width': self.width,
+                'food': [{'x': x, 'y': y} for x, y in self.food],
+                'hazards': [{'x': x, 'y': y} for x, y in self.hazards],
+                'snakes': board_snakes,
+            },
+            'you': you if you is not None else self._snake_dict(snake),
+        }
+
+    def _snake_dict(self, snake: Snake) -> typing.Dict:
+        body = [{'x': x, 'y': y} for x, y in snake.body]
+        return {
+            'id': snake.id,
+            'name': snake.name,
+            'health': snake.health,
+            'body': body,
+            'latency': '0',
+            'head': body[0],
+            'length': len(body),
+            'shout': '',
+            'customizations': {'color': '#888888', 'head': 'default', 'tail': 'default'},
+        }
+
+    # Ask every living snake for its move. Snakes that fail or answer an unknown
+    # direction keep moving the way they last moved
+    def get_moves(self) -> typing.Dict[str, str]:
+        moves = {}
+        alive = self.alive()
+        board_snakes = [self._snake_dict(snake) for snake in alive]
+        for snake in alive:
+            try:
+                move = snake.handlers['move'](self.game_state(snake, board_snakes))['move']
+            except Exception as error:
+                print(f"{snake.name} failed to move on turn {self.turn}: {error!r}")
+                move = None
+            moves[snake.id] = move if move in DIRECTIONS else snake.last_move()
+        return moves
+
+    # Play one turn with moves[snake id] as each living snake's direction
+    def step(self, moves: typing.Dict[str, str]):
+        alive = self.alive()
+        eaten = set()
+        for snake in alive:
+            dx, dy = DIRECTIONS[moves[snake.id]]
+            x, y = snake.body[0][0] + dx, snake.body[0][1] + dy
+            if self.game_mode == 'wrapped':
+                x, y = x % self.width, y % self.height
+            snake.body = [(x, y)] + snake.body[:-1]
+            snake.health -= 1
+        hazards = set(self.hazards)
+        food = set(self.food)
+        for snake in alive:
+            if snake.body[0] in hazards and snake.body[0] not in food:
+                snake.health = max(snake.health - self.settings['hazardDamagePerTurn'], 0)
+        for snake in alive:
+            if snake.body[0] in food:
+                eaten.add(snake.body[0])
+                snake.health = SNAKE_MAX_HEALTH
+                snake.body.append(snake.body[-1])
+        self.food = [cell for cell in self.food if cell not in eaten]
+        self.turn += 1
+        self._eliminate(alive)
+        if len(self.food) < self.settings['minimumFood']:
+            self._spawn_food(self.settings['minimumFood'] - len(self.food))
+        elif self.settings['foodSpawnChance'] > 0 and self.rng.randrange(100) < self.settings['foodSpawnChance']:
+            self._spawn_food(1)
+        if self.game_mode == 'royale':
+            self._shrink()
+
+    def _eliminate(self, alive: typing.List[Snake]):
+        for snake in alive:
+            x, y = snake.body[0]
+            if snake.health <= 0:
+                snake.eliminated_cause = OUT_OF_HEALTH
+            elif not (0 <= x < self.width and 0 <= y < self.height):
+                snake.eliminated_cause = WALL_COLLISION
+        # Collisions are checked against every snake still in the game, then applied together
+        remaining = [snake for snake in alive if snake.eliminated_cause is None]
+        collisions = []
+        for snake in remaining:
+            head = snake.body[0]
+            if head in snake.body[1:]:
+                collisions.append((snake, SELF_COLLISION))
+            elif any(head in other.body[1:] for other in remaining if other is not snake):
+                collisions.append((snake, BODY_COLLISION))
+            elif any(
+                head == other.body[0] and len(snake.body) <= len(other.body)
+                for other in remaining
+                if other is not snake
+            ):
+                collisions.append((snake, HEAD_COLLISION))
+        for snake, cause in collisions:
+            snake.eliminated_cause = cause
+        for snake in alive:
+            if snake.eliminated_cause is not None:
+                snake.eliminated_turn = self.turn
+
+    # Every shrinkEveryNTurns turns, turn one more side of the board into hazards
+    def _shrink(self):
+        every = self.settings['royale']['shrinkEveryNTurns']
+        if every <= 0 or self.turn % every != 0:
+            return
+        left, right, bottom, top = self.safe_bounds
+        if left >= right and bottom >= top:
+            return
+        side = self.rng.randrange(4)
+        if side == 0 and left < right:
+            left += 1
+        elif side == 1 and left < right:
+            right -= 1
+        elif side == 2 and bottom < top:
+            bottom += 1
+        elif bottom < top:
+            top -= 1
+        self.safe_bounds = [left, right, bottom, top]
+        self.hazards = [
+            (x, y)
+            for x in range(self.width)
+            for y in range(self.height)
+            if not (left <= x <= right and bottom <= y <= top)
+        ]
+
+    def is_over(self) -> bool:
+        if self.max_turns is not None and self.turn >= self.max_turns:
+            return True
+        if self.game_mode == 'solo':
+            return len(self.alive()) == 0
+        return len(self.alive()) <= 1
+
+    # Play the game to the end and return its result
+    def play(self) -> typing.Dict:
+        for snake in self.snakes:
+            snake.handlers['start'](self.game_state(snake))
+        while not self.is_over():
+            self.step(self.get_moves())
+        for snake in self.snakes:
+            snake.handlers['end'](self.game_state(snake))
+        return self.result()
+
+    def result(self) -> typing.Dict:
+        alive = self.alive()
+        return {
+            'id': self.id,
+            'game_mode': self.game_mode,
+            'turns': self.turn,
+            'winner': alive[0].name if len(alive) == 1 else None,
+            'snakes': [
+                {
+                    'name': snake.name,
+                    'length': len(snake.body),
+                    'turns_survived': snake.eliminated_turn if snake.eliminated_turn is not None else self.turn,
+                    'eliminated_cause': snake.eliminated_cause,
+                }
+                for snake in self.snakes
+            ],
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--snake', action='append', required=True,
+                        help='Snake script and its arguments, e.g. "sl_snake -m newConv_2.npz". Repeat for each snake.')
+    parser.add_argument('-g', '--game_mode', default='standard', choices=GAME_MODES,
+                        help='Game mode. Default standard.')
+    parser.add_argument('-n', '--games', default=1, type=int,
+                        help='Number of games to play. Default 1.')
+    parser.add_argument('--width', default=11, type=int,
+                        help='Board width. Default 11.')
+    parser.add_argument('--height', default=11, type=int,
+                        help='Board height. Default 11.')
+    parser.add_argument('--seed', default=None, type=int,
+                        help='Seed of the first game, the next games use the following seeds. Default random.')
+    parser.add_argument('--timeout', default=500, type=int,
+                        help='Move timeout in milliseconds sent to the snakes. Default 500.')
+    parser.add_argument('--max_turns', default=None, type=int,
+                        help='Stop games after this many turns. Default no limit.')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="Hide the snakes' own output")
+    args = parser.parse_args()
+
+    snakes = [(f"{i}:{shlex.split(spec)[0]}", load_snake(spec)) for i, spec in enumerate(args.snake)]
+    wins = {name: 0 for name, _ in snakes}
+    for i in range(args.games):
+        seed = None if args.seed is None else args.seed + i
+        game = Game(snakes, args.game_mode, args.width, args.height, seed, args.timeout, max_turns=args.max_turns)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if args.quiet else sys.stdout):
+            result = game.play()
+        if result['winner'] is not None:
+            wins[result['winner']] += 1
+        lengths = ', '.join(f"{snake['name']} {snake['length']}" for snake in result['snakes'])
+        print(f"Game {i + 1}: {result['turns']} turns, winner {result['winner']} | lengths {lengths}")
+    print(f"Wins: {wins}")
@@ -11,9 +11,9 @@ do
         # run the game, output to gamei.json
         ./battlesnake  play -n if_else -u http://localhost:8001 -n sl_snake -u http://localhost:8002 >/dev/null 2>&1
     done
-    python3 parseGameData.py
+    python3 parseGameData.py --augment
     cd snakeSupervision
-    python3 supervisor.py -m newConv_2.h5 2>/dev/null
+    python3 supervisor.py -m newConv_2.h5 --incremental --export 2>/dev/null
     cd ..
-    rm games/*
+    rm -f games/*.bsg games/*.json
 done
\ No newline at end of file
@@ -0,0 +1,279 @@
+# Anytime move search over simultaneous moves.
+#
+# The search is a paranoid minimax: we pick the move that is best against the
+# worst joint reply of every opponent. It runs iterative deepening until a
+# wall clock deadline, so there is always a best move from the last fully
+# searched depth. The board risk functions prune moves into walls and bodies
+# and score the leaves together with the flood fill volume.
+
+import itertools
+import time
+import typing
+
+from board import Board, DIRECTIONS, OFF_BOARD, avoid_walls, avoid_snake_bodies, avoid_heads
+from flood_fill import cached_flood_fill
+from move_watchdog import publish_move
+from zobrist import EXACT, LOWER, UPPER, TranspositionTable, board_hash
+
+# Depth limit in turns, searches that reach it stop early
+MAX_DEPTH = 16
+# Leaf scores
+WIN_SCORE = 1000.0
+LOSS_SCORE = -1000.0
+SPACE_WEIGHT = 10.0
+RISK_WEIGHT = 5.0
+LENGTH_WEIGHT = 1.0
+HEALTH_WEIGHT = 2.0
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+# Given a board and one direction per snake, return the board after one turn of
+# standard rules. Eliminated snakes are removed from the new board
+def simulate(board: Board, directions: typing.Sequence[str]) -> Board:
+    # Move every snake and feed the ones that reached food
+    eaten = set()
+    bodies = []
+    healths = []
+    for i, body in enumerate(board.bodies):
+        new_head = board.moves[directions[i]][body[0]]
+        bodies.append([new_head] + body[:-1])
+        healths.append(board.healths[i] - 1)
+        if new_head != OFF_BOARD and board.food[new_head] == 1:
+            eaten.add(new_head)
+            healths[i] = 100
+            bodies[i].append(body[-1])
+    # Eliminate snakes out of bounds, starved, or colliding with a body
+    occupied = set()
+    for body in bodies:
+        occupied.update(body[1:])
+    alive = [
+        i for i, body in enumerate(bodies)
+        if body[0] != OFF_BOARD and healths[i] > 0 and body[0] not in occupied
+    ]
+    # Head to head collisions eliminate every snake that isn't strictly longest
+    survivors = []
+    for i in alive:
+        head = bodies[i][0]
+        length = len(bodies[i])
+        if all(
+            len(bodies[j]) < length
+            for j in alive
+            if j != i and bodies[j][0] == head
+        ):
+            survivors.append(i)
+    new_board = Board(board.width, board.height, board.turn + 1)
+    for cell in board.food_cells:
+        if cell not in eaten:
+            new_board.add_food(cell)
+    for i in survivors:
+        new_board.add_snake(board.snake_ids[i], bodies[i], healths[i])
+        if i == board.you:
+            new_board.you = len(new_board.bodies) - 1
+            new_board.you_owner = new_board.you + 1
+    return new_board
+
+
+# Given a board and a snake index, return that snake's moves that don't hit a wall
+# or a body, or its least risky moves if there are none
+def candidate_moves(board: Board, index: int) -> typing.List[str]:
+    danger_risk = {"up": 0.0, "down": 0.0, "left": 0.0, "right": 0.0}
+    head = board.head(index)
+    danger_risk = avoid_walls(board, head, danger_risk)
+    danger_risk = avoid_snake_bodies(board, head, danger_risk)
+    min_risk = min(danger_risk.values())
+    return [move for move in DIRECTIONS if danger_risk[move] == min_risk]
+
+
+# Score a board from our point of view, return the score and whether every flood
+# fill finished before the deadline. solo is True if we started the search without
+# opponents, otherwise being the last snake standing is a win
+def evaluate(board: Board, solo: bool, deadline: float,
+             table: typing.Optional[TranspositionTable] = None) -> typing.Tuple[float, bool]:
+    if board.you == -1:
+        return LOSS_SCORE, True
+    if not solo and len(board.bodies) == 1:
+        return WIN_SCORE, True
+    head = board.head(board.you)
+    my_length = len(board.bodies[board.you])
+    danger_risk = {"up": 0.0, "down": 0.0, "left": 0.0, "right": 0.0}
+    danger_risk = avoid_walls(board, head, danger_risk)
+    danger_risk = avoid_snake_bodies(board, head, danger_risk)
+    danger_risk = avoid_heads(board, head, danger_risk)
+    # Space we can keep moving in, relative to our length
+    volume = 0
+    complete = True
+    for cell in board.neighbors[head]:
+        if board.obstacles[cell] <= board.turn:
+            cell_volume, cell_complete = cached_flood_fill(board, cell, my_length, deadline, table)
+            volume = max(volume, cell_volume)
+            complete = complete and cell_complete
+            if volume > my_length:
+                break
+    space = min(volume, my_length) / my_length
+    longest_opponent = max(
+        [len(body) for i, body in enumerate(board.bodies) if i != board.you],
+        default=0
+    )
+    health = board.healths[board.you] / 100
+    return (
+        SPACE_WEIGHT * space
+        - RISK_WEIGHT * min(danger_risk.values())
+        + LENGTH_WEIGHT * (my_length - longest_opponent)
+        + HEALTH_WEIGHT * health
+    ), complete
+
+
+# Get manhattan distance between the heads of two snakes
+def head_dist(board: Board, i: int, j: int) -> int:
+    a, b = board.head(i), board.head(j)
+    width = board.width
+    return abs(a % width - b % width) + abs(a // width - b // width)
+
+
+class MoveSearch:
+    def __init__(self, board: Board, deadline: float, max_depth: int = MAX_DEPTH,
+                 table: typing.Optional[TranspositionTable] = None):
+        self.board = board
+        self.deadline = deadline
+        self.max_depth = max_depth
+        # Values of searched boards, kept between turns by the caller
+        self.table = table
+        self.solo = len(board.bodies) == 1
+        # Best move from the deepest completed search, and that depth
+        self.best_move = None
+        self.depth = 0
+        # Number of leaves scored on a flood fill cut short by the deadline. Values
+        # computed from any of them are not kept in the table
+        self.partial_leaves = 0
+
+    # Run iterative deepening until the deadline or max_depth, return the best move
+    def run(self) -> str:
+        root_moves = candidate_moves(self.board, self.board.you)
+        # Start from the best move found for this board on a previous turn
+        entry = self._lookup(self.board)
+        if entry is not None and entry[3] in root_moves:
+            root_moves.remove(entry[3])
+            root_moves.insert(0, entry[3])
+        self.best_move = root_moves[0]
+        publish_move(self.best_move)
+        for depth in range(1, self.max_depth + 1):
+            try:
+                best_move = self._search_root(root_moves, depth)
+            except SearchTimeout:
+                break
+            self.best_move = best_move
+            self.depth = depth
+            publish_move(best_move)
+            # Search the previous best move first at the next depth
+            root_moves.remove(best_move)
+            root_moves.insert(0, best_move)
+        return self.best_move
+
+    def _check_time(self):
+        if time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+    # Return the table entry (depth, value, flag, best move) for board, if any
+    def _lookup(self, board: Board) -> typing.Optional[typing.Tuple]:
+        if self.table is None:
+            return None
+        return self.table.get(('search', board_hash(board)))
+
+    def _store(self, board: Board, depth: int, value: float, flag: int, best_move: typing.Optional[str]):
+        if self.table is not None:
+            self.table.put(('search', board_hash(board)), (depth, value, flag, best_move))
+
+    def _search_root(self, root_moves: typing.List[str], depth: int) -> str:
+        partial_leaves = self.partial_leaves
+        alpha = float('-inf')
+        best_move = root_moves[0]
+        for move in root_moves:
+            value = self._min_value(self.board, move, depth, alpha, float('inf'))
+            if value > alpha:
+                alpha = value
+                best_move = move
+        if self.partial_leaves == partial_leaves:
+            self._store(self.board, depth, alpha, EXACT, best_move)
+        return best_move
+
+    # Value of our best move on board
+    def _max_value(self, board: Board, depth: int, alpha: float, beta: float) -> float:
+        self._check_time()
+        if board.you == -1 or (not self.solo and len(board.bodies) == 1):
+            # Game over, the value doesn't depend on depth
+            return evaluate(board, self.solo, self.deadline)[0]
+        original_alpha, original_beta = alpha, beta
+        entry = self._lookup(board)
+        table_move = None
+        if entry is not None:
+            entry_depth, value, flag, table_move = entry
+            if entry_depth >= depth:
+                if flag == EXACT:
+                    return value
+                elif flag == LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+        if depth == 0:
+            value, complete = evaluate(board, self.solo, self.deadline, self.table)
+            # A fill cut short by the deadline undercounts the space, don't keep its
+            # score for later turns
+            if complete:
+                self._store(board, 0, value, EXACT, None)
+            else:
+                self.partial_leaves += 1
+            return value
+        partial_leaves = self.partial_leaves
+        moves = candidate_moves(board, board.you)
+        if table_move in moves:
+            moves.remove(table_move)
+            moves.insert(0, table_move)
+        best = float('-inf')
+        best_move = moves[0]
+        for move in moves:
+            value = self._min_value(board, move, depth, alpha, beta)
+            if value > best:
+                best = value
+                best_move = move
+            alpha = max(alpha, best)
+            if alpha >= beta:
+                break
+        if best <= original_alpha:
+            flag = UPPER
+        elif best >= original_beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        if self.partial_leaves == partial_leaves:
+            self._store(board, depth, best, flag, best_move)
+        return best
+
+    # Value of our move on board against the worst joint reply of the opponents
+    def _min_value(self, board: Board, my_move: str, depth: int, alpha: float, beta: float) -> float:
+        replies = []
+        for i in range(len(board.bodies)):
+            if i == board.you:
+                replies.append([my_move])
+            elif head_dist(board, i, board.you) > 2 * depth:
+                # Too far away to reach us within the search, assume its first safe move
+                replies.append(candidate_moves(board, i)[:1])
+            else:
+                replies.append(candidate_moves(board, i))
+        worst = float('inf')
+        for directions in itertools.product(*replies):
+            worst = min(worst, self._max_value(simulate(board, directions), depth - 1, alpha, beta))
+            beta = min(beta, worst)
+            if alpha >= beta:
+                break
+        return worst
+
+
+# Given a board, return the best move found before deadline
+def search(board: Board, deadline: float, max_depth: int = MAX_DEPTH,
+           table: typing.Optional[TranspositionTable] = None) -> str:
+    return MoveSearch(board, deadline, max_depth, table).run()
@@ -0,0 +1,153 @@
+# Welcome to
+# __________         __    __  .__                               __
+# \______   \_____ _/  |__/  |_|  |   ____   ______ ____ _____  |  | __ ____
+#  |    |  _/\__  \\   __\   __\  | _/ __ \ /  ___//    \\__  \ |  |/ // __ \
+#  |    |   \ / __ \|  |  |  | |  |_\  ___/ \___ \|   |  \/ __ \|    <\  ___/
+#  |________/(______/__|  |__| |____/\_____>______>___|__(______/__|__\\_____>
+#
+# This file can be a nice home for your Battlesnake logic and helper functions.
+#
+# To get you started we've included code to prevent your Battlesnake from moving backwards.
+# For more info see docs.battlesnake.com
+
+import argparse
+import random
+import typing
+
+import metrics
+from board import BoardTracker
+from move_watchdog import move_deadline
+from search import MoveSearch
+from zobrist import TranspositionTable
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-c', '--color',
+default=random.choice(["#DFFF00","#FFBF00","#FF7F50","#DE3163","#9FE2BF","#40E0D0","#6495ED","#CCCCFF"]),
+help='Hex color code. Default random.')
+parser.add_argument('-p', '--port', default='8001',
+help='Port to run Battlesnake on. Default 8001.')
+parser.add_argument('-d', '--deployed', action='store_true',
+help='Opens server to the internet')
+parser.add_argument('-w', '--workers', default=0, type=int,
+help='Number of worker processes serving games. Default 0 runs the single process development server.')
+parser.add_argument('--keep_alive', default=5, type=int,
+help='Seconds an idle connection is kept open when running with workers. Default 5.')
+parser.add_argument('--graceful_timeout', default=10, type=int,
+help='Seconds to finish requests in flight on SIGTERM when running with workers. Default 10.')
+parser.add_argument('--watchdog_margin', default=50, type=int,
+help='Milliseconds before the move timeout at which the best move found so far is sent. Default 50.')
+parser.add_argument('--threads', default=32, type=int,
+help='Threads answering requests with workers, at least the number of games played at once. Default 32.')
+parser.add_argument('--time_margin', default=100, type=int,
+help='Milliseconds of the move timeout kept free for network latency. Default 100.')
+parser.add_argument('--max_depth', default=16, type=int,
+help='Maximum number of turns to search ahead. Default 16.')
+parser.add_argument('--table_size', default=200000, type=int,
+help='Maximum number of transposition table entries kept per game. Default 200000.')
+parser.add_argument('--print_level', default=2, type=int, choices=[1,2,3],
+    help='''1: silence all prints
+            2: (Default) silence move(), info(), start()
+            3: print from all endpoints'''
+)
+args = parser.parse_args()
+
+# Game stats
+stats = {
+    'games': 0,
+    'wins': 0,
+    'losses': 0,
+    'sizes': [],
+    'turns': []
+}
+# To handle multiple instance of this snake in the same game
+# Indexed as ongoing_games[game_id][snake_id] = [body_length, turns_survived, board_tracker, transposition_table]
+ongoing_games = {}
+
+
+# info is called when you create your Battlesnake on play.battlesnake.com
+# and controls your Battlesnake's appearance
+# TIP: If you open your Battlesnake URL in a browser you should see this data
+def info() -> typing.Dict:
+    return {
+        "apiversion": "1",
+        "author": "me",
+        "color": args.color,
+        "head": "smart-caterpillar",
+        "tail": "curled",
+    }
+
+
+# start is called when your Battlesnake begins a game
+def start(game_state: typing.Dict):
+    # Initialize game stats
+    global ongoing_games
+    if game_state['game']['id'] not in ongoing_games:
+        ongoing_games[game_state['game']['id']] = {}
+    ongoing_games[game_state['game']['id']][game_state['you']['id']] = [
+        len(game_state['you']['body']), 0, BoardTracker(), TranspositionTable(args.table_size)
+    ]
+
+
+# move is called on every turn and returns your next move
+# Valid moves are "up", "down", "left", or "right"
+# See https://docs.battlesnake.com/api/example-move for available data
+def move(game_state: typing.Dict) -> typing.Dict:
+    global ongoing_games
+    game_info = ongoing_games[game_state['game']['id']][game_state['you']['id']]
+    game_info[0] = len(game_state['you']['body'])
+    game_info[1] = game_state['turn']
+    tracker = game_info[2]
+    table = game_info[3]
+    
+    # Leave time_margin of the game's timeout for the response to reach the server,
+    # counted from the request's arrival
+    deadline = move_deadline(game_state, args.time_margin)
+
+    # Perform pre-processing
+    with metrics.phase('preprocess'):
+        board = tracker.update(game_state)
+
+    # Search ahead until the deadline
+    search = MoveSearch(board, deadline, args.max_depth, table)
+    with metrics.phase('search'):
+        next_move = search.run()
+    if args.print_level >= 3:
+        print(f"MOVE {game_state['turn']}: {next_move} | depth {search.depth}")
+    # Send response to server
+    return {"move": next_move}
+
+
+# end is called when your Battlesnake finishes a game
+def end(game_state: typing.Dict):
+    print("GAME OVER\n")
+    global ongoing_games
+    stats['games'] += 1
+    max_len, turns_survived, _, _ = ongoing_games[game_state['game']['id']][game_state['you']['id']]
+    stats['sizes'].append(max_len)
+    stats['turns'].append(turns_survived)
+    del ongoing_games[game_state['game']['id']][game_state['you']['id']]
+    if len(ongoing_games[game_state['game']['id']]) == 0:
+        del ongoing_games[game_state['game']['id']]
+    winners = [snake['id'] for snake in game_state['board']['snakes']]
+    if len(winners) == 1:
+        if game_state['you']['id'] in winners:
+            stats['wins'] += 1
+        else:
+            stats['losses'] += 1
+    else:
+        stats['losses'] += 1
+    # Print game stats
+    print('STATS:')
+    print(f"Games: {stats['games']}", f"Wins: {stats['wins']}", f"Losses: {stats['losses']}")
+    print(f"Average max body size: {sum(stats['sizes'])/len(stats['sizes']):.1f}")
+    print(f"Average turns survived: {sum(stats['turns'])/len(stats['turns']):.1f}")
+
+
+# Start server when `python main.py` is run
+if __name__ == "__main__":
+    from server import run_server
+
+    run_server(
+        {"info": info, "start": start, "move": move, "end": end, "stats": lambda: stats}, args.port, args.deployed,
+        args.workers, args.keep_alive, args.graceful_timeout, args.watchdog_margin, args.threads
+    )
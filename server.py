@@ -1,12 +1,220 @@
+import json
 import logging
+import multiprocessing
 import os
+import re
+import signal
+import threading
+import time
+import traceback
 import typing
+import zlib
 
 from flask import Flask, request
 
+import metrics
+from move_watchdog import MoveWatchdog, fallback_move
 
-def run_server(handlers: typing.Dict, port_num: int, deployed: bool):
+# orjson parses payloads several times faster than the standard library when installed
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Finds game.id without decoding the whole payload
+GAME_ID_PATTERN = re.compile(rb'"game"\s*:\s*\{[^{}]*?"id"\s*:\s*"((?:[^"\\]|\\.)*)"')
+# Finds game.timeout, the only "timeout" key of a game state
+TIMEOUT_PATTERN = re.compile(rb'"timeout"\s*:\s*(\d+)')
+# Header waitress requests are stamped with the time.monotonic() they were read at,
+# and the WSGI environ key it shows up as
+ARRIVAL_HEADER = 'X_BATTLESNAKE_ARRIVAL'
+ARRIVAL_ENVIRON = 'HTTP_' + ARRIVAL_HEADER
+
+
+# Parse a request body as it is. The snakes build their compact boards from the game
+# state with BoardTracker, which only updates heads, tails and food between turns
+def parse_body(body: bytes) -> typing.Dict:
+    return _loads(body)
+
+
+# Return the game id of a request body
+def get_game_id(body: bytes) -> str:
+    match = GAME_ID_PATTERN.search(body)
+    if match is None:
+        return parse_body(body)['game']['id']
+    return match.group(1).decode()
+
+
+# Return the game's move timeout in milliseconds of a request body
+def get_timeout(body: bytes) -> int:
+    match = TIMEOUT_PATTERN.search(body)
+    if match is None:
+        return parse_body(body)['game']['timeout']
+    return int(match.group(1))
+
+
+# Return this process's latency histograms and the snake's stats
+def collect_metrics(handlers: typing.Dict) -> typing.Tuple[typing.Dict, typing.Dict]:
+    return metrics.snapshot(), handlers["stats"]()
+
+
+# Serve handler calls sent over conn until told to stop
+def _worker_loop(handlers: typing.Dict, conn):
+    # The parent process decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        name, body, deadline = message
+        try:
+            if name == "metrics":
+                conn.send((True, collect_metrics(handlers)))
+            elif body is None:
+                conn.send((True, handlers[name]()))
+            elif deadline is not None:
+                conn.send((True, handlers[name](parse_body(body), deadline)))
+            else:
+                conn.send((True, handlers[name](parse_body(body))))
+        except Exception:
+            traceback.print_exc()
+            conn.send((False, traceback.format_exc()))
+    # Worker processes exit without running atexit, let the snake finish its background work
+    if "close" in handlers:
+        handlers["close"]()
+    conn.close()
+
+
+# Runs the snake's start/move/end handlers in forked worker processes. Every request
+# of a game goes to the same worker, so the globals a snake keeps per game (stats,
+# ongoing_games) stay in one process. Each worker handles one request at a time, and
+# decodes the raw request body itself so game states are never pickled
+class GameWorkerPool:
+    def __init__(self, handlers: typing.Dict, workers: int):
+        context = multiprocessing.get_context('fork')
+        self.connections = []
+        self.locks = []
+        self.processes = []
+        for _ in range(workers):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_worker_loop, args=(handlers, child_conn), daemon=True)
+            process.start()
+            child_conn.close()
+            self.connections.append(parent_conn)
+            self.locks.append(threading.Lock())
+            self.processes.append(process)
+
+    # Index of the worker that handles a game
+    def worker_index(self, game_id: str) -> int:
+        return zlib.crc32(game_id.encode()) % len(self.connections)
+
+    # Run handler name on the request body in the game's worker and return its result.
+    # deadline is passed on to the handler, for moves that must answer by then, and
+    # None is returned if the worker is still busy with another request at the deadline
+    def call(self, name: str, body: bytes, deadline: typing.Optional[float] = None):
+        index = self.worker_index(get_game_id(body))
+        timeout = -1 if deadline is None else max(deadline - time.monotonic(), 0)
+        if not self.locks[index].acquire(timeout=timeout):
+            return None
+        try:
+            self.connections[index].send((name, body, deadline))
+            ok, result = self.connections[index].recv()
+        finally:
+            self.locks[index].release()
+        if not ok:
+            raise Exception(f"Worker {index} failed on {name}:\n{result}")
+        return result
+
+    # Run handler name, which takes no game state, in every worker and return their results
+    def broadcast(self, name: str) -> typing.List:
+        results = []
+        for index, (conn, lock) in enumerate(zip(self.connections, self.locks)):
+            with lock:
+                conn.send((name, None, None))
+                ok, result = conn.recv()
+            if not ok:
+                raise Exception(f"Worker {index} failed on {name}:\n{result}")
+            results.append(result)
+        return results
+
+    # Stop every worker once its current request is done
+    def close(self, timeout: float = 5):
+        for conn, lock in zip(self.connections, self.locks):
+            with lock:
+                conn.send(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+
+# Count requests in flight so shutdown can wait for them
+class InFlight:
+    def __init__(self):
+        self.count = 0
+        self.draining = False
+        self.condition = threading.Condition()
+
+    # Register a request, return False if the server is shutting down
+    def enter(self) -> bool:
+        with self.condition:
+            if self.draining:
+                return False
+            self.count += 1
+            return True
+
+    def leave(self):
+        with self.condition:
+            self.count -= 1
+            self.condition.notify_all()
+
+    # Refuse new requests and wait up to timeout for the current ones
+    def drain(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self.draining = True
+            while self.count > 0 and time.monotonic() < deadline:
+                self.condition.wait(deadline - time.monotonic())
+
+
+def run_server(handlers: typing.Dict, port_num: int, deployed: bool, workers: int = 0,
+               keep_alive: int = 5, graceful_timeout: int = 10, watchdog_margin: int = 50,
+               threads: int = 32):
+    # Answer every move watchdog_margin ms before the game's timeout, even if the strategy runs long
+    handlers = dict(handlers, move=MoveWatchdog(handlers["move"], watchdog_margin))
     app = Flask("Battlesnake")
+    pool = None
+    in_flight = InFlight()
+
+    # Call a game handler on the request body, in the game's worker process if there are
+    # workers. arrival is the time.monotonic() the request was read at, by default now
+    def dispatch(name: str, body: bytes, arrival: typing.Optional[float] = None):
+        start = time.perf_counter()
+        # Moves answer by a deadline set on arrival, so time spent queued for a thread
+        # or a worker counts
+        deadline = None
+        if name == "move":
+            deadline = (arrival or time.monotonic()) + (get_timeout(body) - watchdog_margin) / 1000
+        if pool is None:
+            if deadline is not None:
+                result = handlers[name](parse_body(body), deadline)
+            else:
+                result = handlers[name](parse_body(body))
+        elif not in_flight.enter():
+            return None
+        else:
+            try:
+                result = pool.call(name, body, deadline)
+            finally:
+                in_flight.leave()
+            # The game's worker was still busy at the deadline, answer without it
+            if result is None and name == "move":
+                metrics.count('late_moves')
+                result = {"move": fallback_move(parse_body(body))}
+        metrics.observe('request_seconds', name, time.perf_counter() - start)
+        return result
 
     @app.get("/")
     def on_info():
@@ -14,19 +222,45 @@ def run_server(handlers: typing.Dict, port_num: int, deployed: bool):
 
     @app.post("/start")
     def on_start():
-        game_state = request.get_json()
-        handlers["start"](game_state)
+        dispatch("start", request.get_data())
         return "ok"
 
     @app.post("/move")
     def on_move():
-        game_state = request.get_json()
-        return handlers["move"](game_state)
+        arrival = request.environ.get(ARRIVAL_ENVIRON)
+        move = dispatch("move", request.get_data(), float(arrival) if arrival is not None else None)
+        if move is None:
+            return "shutting down", 503
+        return move
 
     @app.post("/end")
     def on_end():
-        game_state = request.get_json()
-        handlers["end"](game_state)
+        dispatch("end", request.get_data())
+        return "ok"
+
+    # Latency histograms and game stats of every process, in the Prometheus text format
+    @app.get("/metrics")
+    def on_metrics():
+        results = [collect_metrics(handlers)] if pool is None else pool.broadcast("metrics")
+        # Requests are timed here, phases of move() in the process that ran it
+        snapshots = [metrics.snapshot()] if pool is not None else []
+        snapshots.extend(snapshot for snapshot, _ in results)
+        stats = metrics.merge_stats([stats for _, stats in results])
+        body = metrics.render(*metrics.merge_snapshots(snapshots), stats)
+        return body, 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+    # Reload the snake's model in every process, for snakes that have one. Only
+    # answered on the machine running the snake
+    @app.post("/reload")
+    def on_reload():
+        if request.remote_addr not in ("127.0.0.1", "::1"):
+            return "forbidden", 403
+        if "reload" not in handlers:
+            return "nothing to reload", 404
+        if pool is None:
+            handlers["reload"]()
+        else:
+            pool.broadcast("reload")
         return "ok"
 
     @app.after_request
@@ -43,5 +277,50 @@ def run_server(handlers: typing.Dict, port_num: int, deployed: bool):
 
     logging.getLogger("werkzeug").setLevel(logging.ERROR)
 
-    print(f"\nRunning Battlesnake at http://{host}:{port}")
-    app.run(host=host, port=port)
+    if workers == 0:
+        print(f"\nRunning Battlesnake at http://{host}:{port}")
+        app.run(host=host, port=port)
+        return
+
+    import waitress
+    from waitress.channel import HTTPChannel
+
+    # Stamps requests with the time they were read, before they wait in waitress's task
+    # queue for a thread
+    class ArrivalChannel(HTTPChannel):
+        def received(self, data):
+            result = super().received(data)
+            with self.requests_lock:
+                for parsed in self.requests:
+                    if not hasattr(parsed, 'arrival'):
+                        parsed.arrival = time.monotonic()
+                        parsed.headers[ARRIVAL_HEADER] = repr(parsed.arrival)
+            return result
+
+    # Fork the workers before the server starts any threads
+    pool = GameWorkerPool(handlers, workers)
+    # Each request holds a thread until it is answered, so a thread per game played at
+    # once keeps moves from waiting in the task queue
+    server = waitress.create_server(
+        app, host=host, port=port, threads=threads, channel_timeout=keep_alive
+    )
+    server.channel_class = ArrivalChannel
+
+    # On SIGTERM finish the requests in flight, then stop the server like Ctrl+C does
+    def on_sigterm(signum, frame):
+        def drain():
+            in_flight.drain(graceful_timeout)
+            os.kill(os.getpid(), signal.SIGINT)
+        threading.Thread(target=drain, daemon=True).start()
+    signal.signal(signal.SIGTERM, on_sigterm)
+    # Background jobs start with SIGINT ignored, make sure it stops the server
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    print(f"\nRunning Battlesnake at http://{host}:{port} with {workers} workers")
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        pool.close()
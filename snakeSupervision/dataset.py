@@ -0,0 +1,154 @@
+# Binary training data, stored as shards of NumPy arrays.
+#
+# A dataset is a directory holding index.json and, for every shard, an
+# examples .npy file of uint8 inputs shaped (n, x, y, channel) as made by
+# encoder.py, a labels .npy file of n uint8 labels and a sizes .npy file of the n
+# (width, height) of the board each example was encoded from. Shards written before
+# sizes were stored have no sizes file, and their boards are taken to fill the input.
+# Building a dataset again appends new shards, and the index lists them in the
+# order they were written.
+
+import json
+import os
+import typing
+
+import numpy as np
+
+INDEX_FILE = 'index.json'
+# Examples per shard
+SHARD_SIZE = 65536
+
+
+# Return the index of the dataset at path, an empty one if there is none yet
+def read_index(path: str) -> typing.Dict:
+    index_path = os.path.join(path, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return {'shards': []}
+    with open(index_path) as fp:
+        return json.load(fp)
+
+
+# Replace the index of the dataset at path, readers never see a half written index
+def write_index(path: str, index: typing.Dict):
+    index_path = os.path.join(path, INDEX_FILE)
+    with open(index_path + '.tmp', 'w') as fp:
+        json.dump(index, fp, indent=2)
+    os.replace(index_path + '.tmp', index_path)
+
+
+# Collects examples and writes them to a dataset a shard at a time
+class ShardWriter:
+    def __init__(self, path: str, shard_size: int = SHARD_SIZE):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.shard_size = shard_size
+        self.index = read_index(path)
+        self.examples = []
+        self.labels = []
+        self.sizes = []
+        self.pending = 0
+
+    # Add examples encoded from boards of size (width, height), by default the input size
+    def add(self, examples: np.ndarray, labels: np.ndarray, size: typing.Optional[typing.Tuple[int, int]] = None):
+        self.examples.append(examples)
+        self.labels.append(labels)
+        self.sizes.append(np.tile(np.array(size or examples.shape[1:3], dtype=np.uint8), (len(examples), 1)))
+        self.pending += len(examples)
+        while self.pending >= self.shard_size:
+            self._write(self.shard_size)
+
+    # Write every pending example, the last shard may be smaller than shard_size
+    def close(self):
+        if self.pending > 0:
+            self._write(self.pending)
+
+    def _write(self, count: int):
+        examples = np.concatenate(self.examples)
+        labels = np.concatenate(self.labels)
+        sizes = np.concatenate(self.sizes)
+        name = f"shard_{len(self.index['shards']):05d}"
+        np.save(os.path.join(self.path, f"{name}_examples.npy"), examples[:count])
+        np.save(os.path.join(self.path, f"{name}_labels.npy"), labels[:count])
+        np.save(sizes_path(self.path, {'name': name}), sizes[:count])
+        self.index['shards'].append({'name': name, 'count': count})
+        write_index(self.path, self.index)
+        self.examples = [examples[count:]]
+        self.labels = [labels[count:]]
+        self.sizes = [sizes[count:]]
+        self.pending -= count
+
+
+# Return the paths of a shard's examples and labels
+def shard_paths(path: str, shard: typing.Dict) -> typing.Tuple[str, str]:
+    return (
+        os.path.join(path, f"{shard['name']}_examples.npy"),
+        os.path.join(path, f"{shard['name']}_labels.npy"),
+    )
+
+
+# Return the path of a shard's board sizes
+def sizes_path(path: str, shard: typing.Dict) -> str:
+    return os.path.join(path, f"{shard['name']}_sizes.npy")
+
+
+# Reads the examples of a dataset in batches from memory-mapped shards, so only the
+# batches in use are held in memory. Follows the protocol of keras.utils.Sequence,
+# with the order of the examples shuffled every epoch. ids selects a subset of the
+# examples, numbered across the given shards. transform(examples, rng, sizes), like
+# encoder.random_transform, is applied to every batch and its board sizes as it is read
+class ShardLoader:
+    def __init__(self, path: str, batch_size: int = 32, shuffle: bool = True,
+                 seed: typing.Optional[int] = None, shards: typing.Optional[typing.List[typing.Dict]] = None,
+                 ids: typing.Optional[np.ndarray] = None,
+                 transform: typing.Optional[
+                     typing.Callable[[np.ndarray, np.random.Generator, np.ndarray], np.ndarray]] = None):
+        if shards is None:
+            shards = read_index(path)['shards']
+        if len(shards) == 0:
+            raise Exception(f"No training data in {path}")
+        self.examples = []
+        self.labels = []
+        # Board sizes of each shard, None for shards written without them
+        self.sizes = []
+        for shard in shards:
+            examples_path, labels_path = shard_paths(path, shard)
+            self.examples.append(np.load(examples_path, mmap_mode='r'))
+            self.labels.append(np.load(labels_path, mmap_mode='r'))
+            shard_sizes = sizes_path(path, shard)
+            self.sizes.append(np.load(shard_sizes, mmap_mode='r') if os.path.exists(shard_sizes) else None)
+        # Index of each shard's first example
+        self.offsets = np.cumsum([0] + [len(labels) for labels in self.labels])
+        self.order = np.arange(self.offsets[-1]) if ids is None else np.array(ids)
+        self.count = len(self.order)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.transform = transform
+        self.rng = np.random.default_rng(seed)
+        self.on_epoch_end()
+
+    def __len__(self) -> int:
+        return -(-self.count // self.batch_size)
+
+    # Return batch i as float32 inputs and labels
+    def __getitem__(self, i: int) -> typing.Tuple[np.ndarray, np.ndarray]:
+        ids = self.order[i * self.batch_size:(i + 1) * self.batch_size]
+        shard_ids = np.searchsorted(self.offsets, ids, side='right') - 1
+        examples = np.empty((len(ids),) + self.examples[0].shape[1:], dtype=np.float32)
+        labels = np.empty(len(ids), dtype=np.float32)
+        sizes = np.tile(np.array(examples.shape[1:3], dtype=np.uint8), (len(ids), 1))
+        # Read each shard's rows in file order
+        for shard in np.unique(shard_ids):
+            rows = np.flatnonzero(shard_ids == shard)
+            local = ids[rows] - self.offsets[shard]
+            file_order = np.argsort(local)
+            examples[rows[file_order]] = self.examples[shard][local[file_order]]
+            labels[rows[file_order]] = self.labels[shard][local[file_order]]
+            if self.sizes[shard] is not None:
+                sizes[rows[file_order]] = self.sizes[shard][local[file_order]]
+        if self.transform is not None:
+            examples = self.transform(examples, self.rng, sizes)
+        return examples, labels
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.rng.shuffle(self.order)
@@ -0,0 +1,180 @@
+# Encodes battlesnake game states into the network's input tensor.
+#
+# Both the predictor (at inference) and parseGameData.py (when building the
+# dataset) use this module, so the network always sees the same encoding.
+# The tensor is shaped (x, y, channel) with the channels:
+#   0: subject's head, 1: subject's body, 2: other heads, 3: other bodies,
+#   4: food, 5: action (a single marker at x = 0, y = ACTION_INDEX[action])
+# Boards smaller than the input are padded with empty cells past their right
+# and top edges. Boards larger than the input are cropped to a window centred
+# on the subject's head, clamped to the board.
+#
+# For data augmentation, examples can be turned and mirrored with the symmetries of
+# the board. A transformed example is the one made of the transformed game state: the
+# board channels move, and the action marker stays at x = 0 on the transformed
+# action's row. Boards smaller than the input are transformed within the corner they
+# are padded into. Cropped boards have no symmetries, the crop depends on the walls.
+
+import typing
+
+import numpy as np
+
+# Board size the models are trained on
+INPUT_SIZE = (11, 11)
+CHANNELS = 6
+ACTION_CHANNEL = 5
+# Position of each action's marker on the y axis of the action plane
+ACTION_INDEX = {'up': 0, 'down': 1, 'left': 2, 'right': 3}
+# (dx, dy) of each action
+DIRECTIONS = {'up': (0, 1), 'down': (0, -1), 'left': (-1, 0), 'right': (1, 0)}
+
+
+# Given the board length along one axis, the input length and the subject's head
+# coordinate, return the board coordinate mapped to input coordinate 0
+def window_offset(board_len: int, input_len: int, head: int) -> int:
+    if board_len <= input_len:
+        return 0
+    return min(max(head - input_len // 2, 0), board_len - input_len)
+
+
+# Encode a game state from the point of view of subject, leaving the action channel empty
+def encode_state(game_state: typing.Dict, subject: str,
+                 size: typing.Tuple[int, int] = INPUT_SIZE) -> np.ndarray:
+    board_width = game_state['board']['width']
+    board_height = game_state['board']['height']
+    snakes = game_state['board']['snakes']
+
+    # Collect the coordinates and channel of every marker
+    xs = []
+    ys = []
+    channels = []
+    subject_head = {'x': board_width // 2, 'y': board_height // 2}
+    for snake in snakes:
+        if snake['id'] == subject:
+            head_channel, body_channel = 0, 1
+            subject_head = snake['head']
+        else:
+            head_channel, body_channel = 2, 3
+        xs.append(snake['head']['x'])
+        ys.append(snake['head']['y'])
+        channels.append(head_channel)
+        body = snake['body'][1:]
+        xs.extend([part['x'] for part in body])
+        ys.extend([part['y'] for part in body])
+        channels.extend([body_channel] * len(body))
+    food = game_state['board']['food']
+    xs.extend([pos['x'] for pos in food])
+    ys.extend([pos['y'] for pos in food])
+    channels.extend([4] * len(food))
+
+    # Shift into the input window and drop markers outside it
+    xs = np.asarray(xs, dtype=np.intp) - window_offset(board_width, size[0], subject_head['x'])
+    ys = np.asarray(ys, dtype=np.intp) - window_offset(board_height, size[1], subject_head['y'])
+    channels = np.asarray(channels, dtype=np.intp)
+    inside = (xs >= 0) & (xs < size[0]) & (ys >= 0) & (ys < size[1])
+
+    encoded = np.zeros((size[0], size[1], CHANNELS), dtype=np.float32)
+    encoded[xs[inside], ys[inside], channels[inside]] = 1
+    return encoded
+
+
+# Given an encoded state, return one copy per action with its action marked.
+# Unknown actions are left unmarked
+def stamp_actions(encoded: np.ndarray, actions: typing.List[str]) -> np.ndarray:
+    batch = np.repeat(encoded[np.newaxis], len(actions), axis=0)
+    rows = [i for i, action in enumerate(actions) if action in ACTION_INDEX]
+    marks = [ACTION_INDEX[actions[i]] for i in rows]
+    batch[rows, 0, marks, ACTION_CHANNEL] = 1
+    return batch
+
+
+# Encode one training example, a game state seen by subject taking action
+def encode_example(game_state: typing.Dict, subject: str, action: str,
+                   size: typing.Tuple[int, int] = INPUT_SIZE) -> np.ndarray:
+    return stamp_actions(encode_state(game_state, subject, size), [action])[0]
+
+
+# The symmetries of a square board as (transpose, flip x, flip y), applied in that order
+SYMMETRIES = tuple(
+    (transpose, flip_x, flip_y)
+    for transpose in (False, True)
+    for flip_x in (False, True)
+    for flip_y in (False, True)
+)
+IDENTITY = 0
+
+
+# Given a symmetry, return the (dx, dy) a move of (dx, dy) turns into
+def transform_direction(symmetry: typing.Tuple[bool, bool, bool], dx: int, dy: int) -> typing.Tuple[int, int]:
+    transpose, flip_x, flip_y = symmetry
+    if transpose:
+        dx, dy = dy, dx
+    return (-dx if flip_x else dx), (-dy if flip_y else dy)
+
+
+# Return the table mapping[symmetry, ACTION_INDEX[action]] = ACTION_INDEX of the transformed action
+def action_map() -> np.ndarray:
+    mapping = np.zeros((len(SYMMETRIES), len(ACTION_INDEX)), dtype=np.intp)
+    index_of = {direction: ACTION_INDEX[action] for action, direction in DIRECTIONS.items()}
+    for i, symmetry in enumerate(SYMMETRIES):
+        for action, index in ACTION_INDEX.items():
+            mapping[i, index] = index_of[transform_direction(symmetry, *DIRECTIONS[action])]
+    return mapping
+
+
+ACTION_MAP = action_map()
+
+
+# Return the symmetries, as indexes in SYMMETRIES, of a board of the given size
+def board_symmetries(width: int, height: int, size: typing.Tuple[int, int] = INPUT_SIZE) -> typing.List[int]:
+    if width > size[0] or height > size[1]:
+        return [IDENTITY]
+    return [i for i, (transpose, _, _) in enumerate(SYMMETRIES) if width == height or not transpose]
+
+
+# Given encoded examples of boards of the given size, return them transformed by symmetry
+def transform(examples: np.ndarray, symmetry: int, width: int = INPUT_SIZE[0],
+              height: int = INPUT_SIZE[1]) -> np.ndarray:
+    transpose, flip_x, flip_y = SYMMETRIES[symmetry]
+    transformed = examples.copy()
+    board = examples[:, :width, :height, :ACTION_CHANNEL]
+    if transpose:
+        board = board.transpose(0, 2, 1, 3)
+    if flip_x:
+        board = board[:, ::-1]
+    if flip_y:
+        board = board[:, :, ::-1]
+    transformed[:, :width, :height, :ACTION_CHANNEL] = board
+
+    marks = examples[:, 0, :len(ACTION_INDEX), ACTION_CHANNEL]
+    marked = np.flatnonzero(marks.any(axis=1))
+    transformed[:, 0, :len(ACTION_INDEX), ACTION_CHANNEL] = 0
+    transformed[marked, 0, ACTION_MAP[symmetry, marks[marked].argmax(axis=1)], ACTION_CHANNEL] = 1
+    return transformed
+
+
+# Given examples and labels of boards of the given size, return them with a copy for
+# every symmetry of the board, the original examples first
+def add_symmetries(examples: np.ndarray, labels: np.ndarray, width: int = INPUT_SIZE[0],
+                   height: int = INPUT_SIZE[1]) -> typing.Tuple[np.ndarray, np.ndarray]:
+    symmetries = board_symmetries(width, height, examples.shape[1:3])
+    augmented = [transform(examples, symmetry, width, height) if symmetry != IDENTITY else examples
+                 for symmetry in symmetries]
+    return np.concatenate(augmented), np.tile(labels, len(symmetries))
+
+
+# Transform each example of a batch by a random symmetry of its board, in place.
+# sizes holds the (width, height) of each example's board, by default the input size
+def random_transform(examples: np.ndarray, rng: np.random.Generator,
+                     sizes: typing.Optional[np.ndarray] = None) -> np.ndarray:
+    if sizes is None:
+        sizes = np.tile(examples.shape[1:3], (len(examples), 1))
+    for width, height in np.unique(sizes, axis=0).tolist():
+        rows = np.flatnonzero((sizes[:, 0] == width) & (sizes[:, 1] == height))
+        symmetries = board_symmetries(width, height, examples.shape[1:3])
+        choices = rng.choice(symmetries, size=len(rows))
+        for symmetry in symmetries:
+            selected = rows[choices == symmetry]
+            if symmetry != IDENTITY and len(selected) > 0:
+                examples[selected] = transform(examples[selected], symmetry, width, height)
+    return examples
@@ -0,0 +1,74 @@
+# Export a keras .h5 model to the .npz format used by NumpyModel.
+# Reads the .h5 file directly with h5py, so TensorFlow isn't needed.
+import argparse
+import json
+import os
+import typing
+
+import h5py
+import numpy as np
+
+# Layer settings NumpyModel needs, by keras layer class
+LAYER_SETTINGS = {
+    'Conv2D': ('activation', 'strides', 'padding'),
+    'MaxPooling2D': ('pool_size', 'strides', 'padding'),
+    'Dense': ('activation',),
+}
+# Keras weight names are "<layer>/<name>:0"
+WEIGHT_NAMES = ('kernel', 'bias')
+
+
+# Given a keras 2 .h5 model file, return its layer configs and weights
+def read_h5_model(h5_path: str) -> typing.Tuple[typing.List[typing.Dict], typing.List[typing.Dict]]:
+    layers = []
+    weights = []
+    with h5py.File(h5_path, 'r') as h5_file:
+        model_config = json.loads(h5_file.attrs['model_config'])
+        if model_config['class_name'] != 'Sequential':
+            raise Exception(f"Only Sequential models can be exported, got {model_config['class_name']}")
+        model_weights = h5_file['model_weights']
+        for layer_config in model_config['config']['layers']:
+            class_name = layer_config['class_name']
+            config = layer_config['config']
+            layer = {'class_name': class_name, 'weights': []}
+            for setting in LAYER_SETTINGS.get(class_name, ()):
+                layer[setting] = config[setting]
+            layer_weights = {}
+            if config['name'] in model_weights:
+                group = model_weights[config['name']]
+                for weight_name in group.attrs['weight_names']:
+                    if isinstance(weight_name, bytes):
+                        weight_name = weight_name.decode()
+                    short_name = weight_name.split('/')[-1].split(':')[0]
+                    if short_name not in WEIGHT_NAMES:
+                        raise Exception(f"Unsupported weight {weight_name}")
+                    layer_weights[short_name] = np.asarray(group[weight_name], dtype=np.float32)
+            layer['weights'] = [name for name in WEIGHT_NAMES if name in layer_weights]
+            layers.append(layer)
+            weights.append(layer_weights)
+    return layers, weights
+
+
+# Write the model in h5_path to npz_path. The file is replaced in one step, so a snake
+# reloading it never reads a partly written model
+def export_model(h5_path: str, npz_path: str):
+    layers, weights = read_h5_model(h5_path)
+    arrays = {'config': np.array(json.dumps(layers))}
+    for i, layer_weights in enumerate(weights):
+        for name, value in layer_weights.items():
+            arrays[f"layer{i}_{name}"] = value
+    tmp_path = os.path.splitext(npz_path)[0] + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, npz_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--model', default='convModel.h5',
+                        help='Keras model to export. Default convModel.h5')
+    parser.add_argument('-o', '--output', default=None,
+                        help='Path of the exported model. Default is the model path with a .npz extension')
+    args = parser.parse_args()
+    output = args.output or os.path.splitext(args.model)[0] + '.npz'
+    export_model(args.model, output)
+    print(f"Exported {args.model} to {output}")
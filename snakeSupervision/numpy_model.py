@@ -0,0 +1,107 @@
+# NumPy-only forward pass for the small sequential models trained by supervisor.py.
+#
+# Models are exported from keras .h5 files by export.py into a flat .npz file
+# holding a JSON description of the layers and one array per weight. Loading
+# one only needs NumPy, so snakes start without importing TensorFlow.
+
+import json
+import typing
+
+import numpy as np
+
+# Layers that only matter while training
+PASSTHROUGH_LAYERS = ('InputLayer', 'Dropout')
+
+
+def softmax(x: np.ndarray) -> np.ndarray:
+    exp = np.exp(x - x.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+    'tanh': np.tanh,
+    'softmax': softmax,
+}
+
+
+# Pad the x and y axes of a batch of (x, y, channel) inputs the way keras does for
+# padding="same", so every stride step has a full window
+def pad_same(inputs: np.ndarray, window: typing.Sequence[int], strides: typing.Sequence[int],
+             value: float = 0) -> np.ndarray:
+    pads = [(0, 0)]
+    for axis in range(2):
+        length = inputs.shape[axis + 1]
+        total = max((-(-length // strides[axis]) - 1) * strides[axis] + window[axis] - length, 0)
+        pads.append((total // 2, total - total // 2))
+    pads.append((0, 0))
+    return np.pad(inputs, pads, constant_values=value)
+
+
+# Return every window of the x and y axes, shaped (batch, x, y, channel, window x, window y)
+def get_windows(inputs: np.ndarray, window: typing.Sequence[int], strides: typing.Sequence[int]) -> np.ndarray:
+    windows = np.lib.stride_tricks.sliding_window_view(inputs, tuple(window), axis=(1, 2))
+    return windows[:, ::strides[0], ::strides[1]]
+
+
+def conv2d(inputs: np.ndarray, layer: typing.Dict, weights: typing.List[np.ndarray]) -> np.ndarray:
+    kernel = weights[0]
+    if layer['padding'] == 'same':
+        inputs = pad_same(inputs, kernel.shape[:2], layer['strides'])
+    windows = get_windows(inputs, kernel.shape[:2], layer['strides'])
+    # Kernel is shaped (window x, window y, channel, filters)
+    outputs = np.tensordot(windows, kernel, axes=([3, 4, 5], [2, 0, 1]))
+    if len(weights) > 1:
+        outputs += weights[1]
+    return outputs
+
+
+def max_pooling2d(inputs: np.ndarray, layer: typing.Dict, weights: typing.List[np.ndarray]) -> np.ndarray:
+    if layer['padding'] == 'same':
+        inputs = pad_same(inputs, layer['pool_size'], layer['strides'], -np.inf)
+    return get_windows(inputs, layer['pool_size'], layer['strides']).max(axis=(4, 5))
+
+
+def flatten(inputs: np.ndarray, layer: typing.Dict, weights: typing.List[np.ndarray]) -> np.ndarray:
+    return inputs.reshape(len(inputs), -1)
+
+
+def dense(inputs: np.ndarray, layer: typing.Dict, weights: typing.List[np.ndarray]) -> np.ndarray:
+    outputs = inputs @ weights[0]
+    if len(weights) > 1:
+        outputs += weights[1]
+    return outputs
+
+
+LAYERS = {
+    'Conv2D': conv2d,
+    'MaxPooling2D': max_pooling2d,
+    'Flatten': flatten,
+    'Dense': dense,
+}
+
+
+class NumpyModel:
+    def __init__(self, path: str):
+        with np.load(path) as data:
+            self.layers = json.loads(str(data['config']))
+            self.weights = [
+                [data[f"layer{i}_{name}"] for name in layer['weights']]
+                for i, layer in enumerate(self.layers)
+            ]
+        for layer in self.layers:
+            if layer['class_name'] not in LAYERS and layer['class_name'] not in PASSTHROUGH_LAYERS:
+                raise Exception(f"Unsupported layer {layer['class_name']}")
+
+    # Run the model on a batch of inputs, called the same way as a keras model
+    def __call__(self, inputs: np.ndarray, training: bool = False) -> np.ndarray:
+        outputs = np.asarray(inputs, dtype=np.float32)
+        for layer, weights in zip(self.layers, self.weights):
+            if layer['class_name'] in PASSTHROUGH_LAYERS:
+                continue
+            outputs = LAYERS[layer['class_name']](outputs, layer, weights)
+            if 'activation' in layer:
+                outputs = ACTIVATIONS[layer['activation']](outputs)
+        return outputs
@@ -1,56 +1,97 @@
 # Given a game state, the predictor should return a list of 4 numbers, representing the probabilty of wining 
 # if the snake moves up, down, left, or right, respectively.
 # The predictor loads model.h5, which is a keras model that was trained on the data in trainingData.json.
+# Models exported to .npz by export.py run on NumPy alone, without loading TensorFlow.
+# When the model file is replaced, the new model is loaded and warmed up in the
+# background, then swapped in between predictions.
 
+import os
+import threading
+import time
+import traceback
 import typing
 
-import keras
 import numpy as np
 
+from snakeSupervision.encoder import ACTION_INDEX, CHANNELS, INPUT_SIZE, encode_state, stamp_actions
+from snakeSupervision.numpy_model import NumpyModel
+
+
+# Load a model, choosing the backend from the file extension
+def load_model(path: str):
+    if path.endswith('.npz'):
+        return NumpyModel(path)
+    import keras
+    return keras.models.load_model(path)
+
+
+# Load a model and run it once, so its first real prediction isn't slowed by setup
+def load_warm_model(path: str):
+    model = load_model(path)
+    model(np.zeros((len(ACTION_INDEX), INPUT_SIZE[0], INPUT_SIZE[1], CHANNELS), dtype=np.float32), training=False)
+    return model
+
+
+# Return what identifies the current version of a file, None if it doesn't exist
+def file_version(path: str) -> typing.Optional[typing.Tuple[int, int, int]]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
 
 class Predictor:
-    def __init__(self, model_path: str):
+    # reload_interval is the number of seconds between checks for a new model file, 0 never checks
+    def __init__(self, model_path: str, reload_interval: float = 0):
+        self.path = f"snakeSupervision/{model_path}"
+        self.version = file_version(self.path)
         # Load model
-        self.model = keras.models.load_model(f"snakeSupervision/{model_path}")
+        self.model = load_warm_model(self.path)
         self.model_path = model_path
+        self.reload_interval = reload_interval
+        self.next_check = time.monotonic() + reload_interval
+        self.reload_lock = threading.Lock()
+        self.reloads = 0
+
+    # Start reloading the model in the background if its file changed since it was loaded.
+    # Checks the file at most once every reload_interval seconds
+    def check_reload(self):
+        if self.reload_interval <= 0 or time.monotonic() < self.next_check:
+            return
+        self.next_check = time.monotonic() + self.reload_interval
+        if file_version(self.path) != self.version and not self.reload_lock.locked():
+            threading.Thread(target=self.reload, daemon=True).start()
+
+    # Load the model file again and swap it in once it is warm. Predictions keep using the
+    # old model until then, and a model that fails to load is never swapped in
+    def reload(self):
+        with self.reload_lock:
+            version = file_version(self.path)
+            try:
+                model = load_warm_model(self.path)
+            except Exception:
+                traceback.print_exc()
+                self.version = version
+                return
+            self.model = model
+            self.version = version
+            self.reloads += 1
+            print(f"Reloaded model {self.model_path}")
 
     def predict(self, game_state: typing.Dict, action: str, subject: str):
-        board_width = game_state['board']['width']
-        board_height = game_state['board']['height']
-
-        # Transform game state into nn input arrays
-        subject_head = np.zeros((board_width, board_height))
-        subject_body = np.zeros((board_width, board_height))
-        heads_array = np.zeros((board_width, board_height))
-        bodies_array = np.zeros((board_width, board_height))
-        for snake in game_state['board']['snakes']:
-            if snake['id'] == subject:
-                subject_head[snake['head']['x']][snake['head']['y']] = 1
-                for part in snake['body'][1:]:
-                    subject_body[part['x']][part['y']] = 1
-            else:
-                heads_array[snake['head']['x']][snake['head']['y']] = 1
-                for part in snake['body'][1:]:
-                    bodies_array[part['x']][part['y']] = 1
-
-        food_array = np.zeros((board_width, board_height))
-        for food in game_state['board']['food']:
-            food_array[food['x']][food['y']] = 1
-
-        actions_array = np.zeros((board_width, board_height))
-        if action == 'up':
-            actions_array[0][0] = 1
-        elif action == 'down':
-            actions_array[0][1] = 1
-        elif action == 'left':
-            actions_array[0][2] = 1
-        elif action == 'right':
-            actions_array[0][3] = 1
-        nn_inputs = np.array(
-            [subject_head, subject_body, heads_array, bodies_array, food_array, actions_array]
-        )
-        nn_inputs = np.transpose(nn_inputs, (1, 2, 0)).reshape(1, 11, 11, 6)
-
-        # Predict probabilty of winning with this action
-        prediction = (action, self.model(nn_inputs, training=False))
-        return (prediction[0], float(prediction[1][0][0]))
+        return self.predict_batch(game_state, [action], subject)[0]
+
+    # Predict the probability of winning for every action in a single model call
+    def predict_batch(self, game_state: typing.Dict, actions: typing.List[str], subject: str):
+        # Transform game state into nn input arrays, one per action
+        nn_inputs = stamp_actions(encode_state(game_state, subject), actions)
+
+        # Predict probabilty of winning with each action
+        predictions = self.predict_inputs(nn_inputs)
+        return [(action, float(predictions[i])) for i, action in enumerate(actions)]
+
+    # Given a batch of encoded inputs, return the probability of winning of each one
+    def predict_inputs(self, nn_inputs: np.ndarray) -> np.ndarray:
+        self.check_reload()
+        return np.asarray(self.model(nn_inputs, training=False))[:, 0]
@@ -1,67 +1,153 @@
 # Train a model to predict if player 0 will win a battlesnake game given a game state.
+#
+# With --incremental, training resumes from the saved model (or its exported .npz
+# weights) and only uses the shards added since the model was last trained, plus a
+# bounded replay sample of older examples. The shards a model has been trained on
+# are kept in <model>.state.json. Models are checkpointed after every epoch, and
+# every file is written under a temporary name and then renamed, so a snake
+# reloading the model never reads a partly written file.
 import argparse
 import json
+import os
 
 import keras
 import numpy as np
 from keras.layers import Input, Conv2D, Flatten, Dense
 from keras.models import Sequential, Model
 
+from dataset import ShardLoader, read_index
+from encoder import random_transform
+from export import export_model
+from numpy_model import NumpyModel
+
 parser = argparse.ArgumentParser()
 parser.add_argument('-m', '--model', default='convModel.h5')
+parser.add_argument('-d', '--data', default='shards',
+                    help='Dataset directory written by parseGameData.py. Default shards.')
+parser.add_argument('-b', '--batch_size', default=32, type=int,
+                    help='Examples per training batch. Default 32.')
+parser.add_argument('-e', '--epochs', default=5, type=int,
+                    help='Training epochs. Default 5.')
+parser.add_argument('-i', '--incremental', action='store_true',
+                    help='Resume from the saved model and train on the new shards and a replay sample')
+parser.add_argument('-r', '--replay', default=50000, type=int,
+                    help='Examples of already trained shards replayed in incremental mode. Default 50000.')
+parser.add_argument('--export', action='store_true',
+                    help='Also export the model to .npz after every epoch')
+parser.add_argument('-a', '--augment', action='store_true',
+                    help='Turn and mirror every training example by a random symmetry of its board')
 args = parser.parse_args()
 
 
-# loads training examples from json file
-def getTrainingExamples():
-    trainingExamples = []
-    with open("trainingExamples.json") as json_file:
-        for line in json_file:
-            ex = json.loads(line)
-            input_array = np.transpose(np.asarray(ex), (1,2,0))
-            trainingExamples.append(input_array)
-    return trainingExamples
+# Feeds keras the batches of a ShardLoader, which reads them from memory-mapped shards
+class ShardSequence(keras.utils.Sequence):
+    def __init__(self, loader: ShardLoader):
+        super().__init__()
+        self.loader = loader
 
+    def __len__(self):
+        return len(self.loader)
 
-# loads training labels from json file
-def getTrainingLabels():
-    with open("trainingLabels.json") as json_file:
-        trainingLabels = [int(c) for c in json_file.read()]
-    return trainingLabels
+    def __getitem__(self, i):
+        return self.loader[i]
 
+    def on_epoch_end(self):
+        self.loader.on_epoch_end()
 
-# Conv net
-# Input layer with 6 channels
-model = Sequential()
-model.add(Conv2D(
-    32, kernel_size=(3, 3), activation='relu', 
-    input_shape=(11, 11, 6)
-))
-model.add(Flatten())
-model.add(Dense(128, activation='relu'))
-model.add(Dense(64, activation='relu'))
-model.add(Dense(1, activation='sigmoid'))
+
+# Saves the model, and its .npz export with --export, after every epoch
+class AtomicCheckpoint(keras.callbacks.Callback):
+    def on_epoch_end(self, epoch, logs=None):
+        save_model(self.model)
 
 
-# compiles model
-model.compile(optimizer='adam',
-              loss='binary_crossentropy',
-              metrics=['accuracy'])
+# Save model to args.model in one step
+def save_model(model):
+    root, ext = os.path.splitext(args.model)
+    tmp_path = f"{root}.tmp{ext}"
+    model.save(tmp_path)
+    os.replace(tmp_path, args.model)
+    if args.export:
+        export_model(args.model, root + '.npz')
 
-# formats training examples into a numpy array
-trainingExamples = np.asarray(getTrainingExamples())
-trainingLabels = np.asarray(getTrainingLabels())
 
-# trains model
-model.fit(trainingExamples, trainingLabels, epochs=5)
+# Conv net
+# Input layer with 6 channels
+def build_model():
+    model = Sequential()
+    model.add(Conv2D(
+        32, kernel_size=(3, 3), activation='relu',
+        input_shape=(11, 11, 6)
+    ))
+    model.add(Flatten())
+    model.add(Dense(128, activation='relu'))
+    model.add(Dense(64, activation='relu'))
+    model.add(Dense(1, activation='sigmoid'))
+    return model
+
+
+# Copy the weights of an exported .npz model into a model with the same layers
+def load_npz_weights(model, npz_path: str):
+    exported = [weights for weights in NumpyModel(npz_path).weights if len(weights) > 0]
+    layers = [layer for layer in model.layers if len(layer.get_weights()) > 0]
+    if len(exported) != len(layers):
+        raise Exception(f"{npz_path} has {len(exported)} layers with weights, the model has {len(layers)}")
+    for layer, weights in zip(layers, exported):
+        layer.set_weights(weights)
+
+
+state_path = os.path.splitext(args.model)[0] + '.state.json'
+npz_path = os.path.splitext(args.model)[0] + '.npz'
+shards = read_index(args.data)['shards']
+trained = []
+if args.incremental and os.path.exists(state_path):
+    with open(state_path) as fp:
+        trained = json.load(fp)['trained_shards']
+
+# Resume from the saved model, or start a new one
+if args.incremental and os.path.exists(args.model):
+    model = keras.models.load_model(args.model)
+else:
+    model = build_model()
+    if args.incremental and os.path.exists(npz_path):
+        load_npz_weights(model, npz_path)
+
+    # compiles model
+    model.compile(optimizer='adam',
+                  loss='binary_crossentropy',
+                  metrics=['accuracy'])
+
+# Train on the new shards, with a random sample of the trained ones replayed
+new_shards = [shard for shard in shards if shard['name'] not in trained]
+old_shards = [shard for shard in shards if shard['name'] in trained]
+if len(new_shards) == 0:
+    print('No new training data')
+    raise SystemExit
+new_count = sum(shard['count'] for shard in new_shards)
+old_count = sum(shard['count'] for shard in old_shards)
+replay_ids = np.random.default_rng().choice(old_count, min(args.replay, old_count), replace=False)
+ids = np.concatenate([np.arange(new_count), new_count + np.sort(replay_ids)])
+
+# streams shuffled training batches from the dataset shards
+trainingData = ShardSequence(ShardLoader(
+    args.data, args.batch_size, shards=new_shards + old_shards, ids=ids,
+    transform=random_transform if args.augment else None
+))
 
-# saves model
-model.save(args.model)
+# trains model, saving it after every epoch
+model.fit(trainingData, epochs=args.epochs, callbacks=[AtomicCheckpoint()])
+
+# records the shards the model has seen
+with open(state_path + '.tmp', 'w') as fp:
+    json.dump({'trained_shards': [shard['name'] for shard in old_shards + new_shards]}, fp)
+os.replace(state_path + '.tmp', state_path)
 
 # Load model
 model = keras.models.load_model(args.model)
 
 # Test model
-test_loss, test_acc = model.evaluate(np.array(trainingExamples), np.array(trainingLabels))
+test_loss, test_acc = model.evaluate(ShardSequence(
+    ShardLoader(args.data, args.batch_size, shuffle=False, shards=new_shards + old_shards, ids=ids)
+))
 
-print('Test accuracy:', test_acc)
\ No newline at end of file
+print('Test accuracy:', test_acc)
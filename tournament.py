@@ -0,0 +1,195 @@
+# Plays tournaments between snakes on every core with the in-process rules engine.
+#
+# Games are spread over a process pool. Each worker loads every snake once and
+# plays whole games, so snakes keep their per game state in one process. Every
+# game gets its own seed, used for the board and for the snakes' random moves,
+# so a tournament with a fixed --seed plays the same games again.
+#
+# Formats:
+#   round_robin: every pair of snakes plays --games games
+#   ladder: snakes start ranked in the given order. Each round, neighbours on the
+#           ladder play --games games and the lower ranked one moves up if it
+#           won more of them. Rounds alternate between the even and odd pairs
+
+import argparse
+import contextlib
+import multiprocessing
+import os
+import random
+import typing
+
+from rules import GAME_MODES, Game, load_snake
+
+FORMATS = ('round_robin', 'ladder')
+
+
+# Given the specs of the snakes in a game, its settings and seed, play it in this
+# worker and return its result. Snakes are named by their spec
+def play_game(task: typing.Tuple) -> typing.Dict:
+    specs, game_mode, width, height, seed, timeout, max_turns = task
+    snakes = [(spec, load_snake(spec)) for spec in specs]
+    # Snakes pick among equal moves with the random module
+    random.seed(seed)
+    game = Game(snakes, game_mode, width, height, seed, timeout, max_turns=max_turns)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return game.play()
+
+
+def new_stats() -> typing.Dict:
+    return {'games': 0, 'wins': 0, 'losses': 0, 'sizes': [], 'turns': []}
+
+
+# Add a game result to stats[snake] the way each snake's end() counts it
+def record_result(stats: typing.Dict[str, typing.Dict], result: typing.Dict):
+    for snake in result['snakes']:
+        snake_stats = stats.setdefault(snake['name'], new_stats())
+        snake_stats['games'] += 1
+        snake_stats['sizes'].append(snake['length'])
+        snake_stats['turns'].append(snake['turns_survived'])
+        if result['winner'] == snake['name']:
+            snake_stats['wins'] += 1
+        else:
+            snake_stats['losses'] += 1
+
+
+class Tournament:
+    def __init__(self, specs: typing.List[str], game_mode: str = 'standard', width: int = 11, height: int = 11,
+                 games: int = 10, seed: int = 0, timeout: int = 500, max_turns: typing.Optional[int] = None,
+                 processes: typing.Optional[int] = None):
+        if len(set(specs)) != len(specs):
+            raise Exception("Every snake in a tournament must have a different spec")
+        self.specs = specs
+        self.settings = (game_mode, width, height)
+        self.games = games
+        self.seed = seed
+        self.timeout = timeout
+        self.max_turns = max_turns
+        self.processes = processes or os.cpu_count()
+        # Indexed as stats[snake spec], shaped like the stats each snake keeps
+        self.stats = {spec: new_stats() for spec in specs}
+        # Indexed as matches[(snake spec, opponent spec)] = [wins, losses, draws, longest game, total turns]
+        self.matches = {}
+        self.played = 0
+
+    # Return the tasks of games games between a and b, with the next seeds
+    def _match_tasks(self, a: str, b: str) -> typing.List[typing.Tuple]:
+        tasks = []
+        for i in range(self.games):
+            # Alternate which snake is listed first, the start cells are shuffled anyway
+            specs = (a, b) if i % 2 == 0 else (b, a)
+            tasks.append((specs, *self.settings, self.seed + self.played, self.timeout, self.max_turns))
+            self.played += 1
+        return tasks
+
+    def _record_match(self, a: str, b: str, results: typing.List[typing.Dict]) -> typing.Tuple[int, int]:
+        a_wins = b_wins = 0
+        for result in results:
+            record_result(self.stats, result)
+            a_wins += result['winner'] == a
+            b_wins += result['winner'] == b
+            for snake, opponent in ((a, b), (b, a)):
+                match = self.matches.setdefault((snake, opponent), [0, 0, 0, 0, 0])
+                if result['winner'] == snake:
+                    match[0] += 1
+                elif result['winner'] == opponent:
+                    match[1] += 1
+                else:
+                    match[2] += 1
+                match[3] = max(match[3], result['turns'])
+                match[4] += result['turns']
+        return a_wins, b_wins
+
+    # Play every pair of snakes against each other
+    def round_robin(self, pool):
+        pairs = [
+            (a, b)
+            for i, a in enumerate(self.specs)
+            for b in self.specs[i + 1:]
+        ]
+        tasks = [self._match_tasks(a, b) for a, b in pairs]
+        results = pool.map(play_game, [task for match in tasks for task in match], chunksize=1)
+        for i, (a, b) in enumerate(pairs):
+            self._record_match(a, b, results[i * self.games:(i + 1) * self.games])
+
+    # Play rounds of matches between neighbours on the ladder, return the final ranking
+    def ladder(self, pool, rounds: int) -> typing.List[str]:
+        ranking = list(self.specs)
+        for round_num in range(rounds):
+            pairs = [(ranking[i], ranking[i + 1]) for i in range(round_num % 2, len(ranking) - 1, 2)]
+            tasks = [self._match_tasks(a, b) for a, b in pairs]
+            results = pool.map(play_game, [task for match in tasks for task in match], chunksize=1)
+            for i, (a, b) in enumerate(pairs):
+                a_wins, b_wins = self._record_match(a, b, results[i * self.games:(i + 1) * self.games])
+                if b_wins > a_wins:
+                    index = ranking.index(a)
+                    ranking[index], ranking[index + 1] = b, a
+        return ranking
+
+    # Return one table per snake in the format of the stats/ examples
+    def format_matches(self) -> str:
+        lines = []
+        for spec in self.specs:
+            lines.append(spec)
+            lines.append("Opponent Name | Games Played | Win/Loss | Wins | Losses | Draws | Longest | Avg Length")
+            lines.append("--------------------------------------------------------------------------")
+            for (snake, opponent), (wins, losses, draws, longest, total) in self.matches.items():
+                if snake != spec:
+                    continue
+                played = wins + losses + draws
+                win_loss = 100 * wins / (wins + losses) if wins + losses > 0 else 0
+                lines.append(
+                    f"{opponent:<13} | {played:<12} | {win_loss:<8.3f} | {wins:<4} | {losses:<6} | "
+                    f"{draws:<5} | {longest:<7} | {total / played:<10.3f}"
+                )
+            lines.append("")
+        return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--snake', action='append', default=None,
+                        help='Snake script and its arguments, e.g. "sl_snake -m newConv_2.npz". Repeat for each snake. '
+                             'Default main, flood_filler and sl_snake.')
+    parser.add_argument('-f', '--format', default='round_robin', choices=FORMATS,
+                        help='Tournament format. Default round_robin.')
+    parser.add_argument('-n', '--games', default=10, type=int,
+                        help='Games per match. Default 10.')
+    parser.add_argument('-r', '--rounds', default=None, type=int,
+                        help='Rounds of a ladder tournament. Default one per snake.')
+    parser.add_argument('-g', '--game_mode', default='standard', choices=GAME_MODES,
+                        help='Game mode. Default standard.')
+    parser.add_argument('--width', default=11, type=int,
+                        help='Board width. Default 11.')
+    parser.add_argument('--height', default=11, type=int,
+                        help='Board height. Default 11.')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='Seed of the first game, the next games use the following seeds. Default 0.')
+    parser.add_argument('--timeout', default=500, type=int,
+                        help='Move timeout in milliseconds sent to the snakes. Default 500.')
+    parser.add_argument('--max_turns', default=None, type=int,
+                        help='Stop games after this many turns. Default no limit.')
+    parser.add_argument('-p', '--processes', default=None, type=int,
+                        help='Number of worker processes. Default one per core.')
+    args = parser.parse_args()
+
+    specs = args.snake or ['main', 'flood_filler', 'sl_snake -m newConv_2.npz']
+    tournament = Tournament(
+        specs, args.game_mode, args.width, args.height, args.games, args.seed, args.timeout,
+        args.max_turns, args.processes
+    )
+    with multiprocessing.Pool(tournament.processes) as pool:
+        if args.format == 'round_robin':
+            tournament.round_robin(pool)
+        else:
+            ranking = tournament.ladder(pool, args.rounds or len(specs))
+            print('LADDER:')
+            for place, spec in enumerate(ranking):
+                print(f"{place + 1}. {spec}")
+            print()
+    print(tournament.format_matches())
+    print('STATS:')
+    for spec, stats in tournament.stats.items():
+        print(f"{spec}: Games: {stats['games']}", f"Wins: {stats['wins']}", f"Losses: {stats['losses']}")
+        if stats['games'] > 0:
+            print(f"Average max body size: {sum(stats['sizes'])/len(stats['sizes']):.1f}")
+            print(f"Average turns survived: {sum(stats['turns'])/len(stats['turns']):.1f}")
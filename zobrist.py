@@ -0,0 +1,97 @@
+# Zobrist hashing of boards and a size bounded transposition table.
+#
+# A board hash is the XOR of one random key per feature: each food cell, each
+# body part (by cell, lifetime and whether it is ours) and each snake's health
+# (by head cell). Keys are generated from a fixed seed per board size, so
+# hashes are stable between turns, games and processes.
+
+import functools
+import random
+import typing
+from collections import OrderedDict
+
+from board import Board
+
+MAX_HEALTH = 100
+# Default number of entries kept per table
+TABLE_SIZE = 200000
+# Flags describing how a stored search value relates to the true value
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+
+class ZobristKeys:
+    def __init__(self, width: int, height: int):
+        self.size = width * height
+        self._rng = random.Random(f"zobrist-{width}x{height}")
+        self.food = self._new_keys(self.size)
+        # Indexed as health[kind][health * size + head], kind 0 is our snake
+        self.health = [self._new_keys((MAX_HEALTH + 1) * self.size) for _ in range(2)]
+        # Indexed as parts[kind][lifetime][cell], extended as longer snakes appear
+        self.parts = [[], []]
+
+    def _new_keys(self, count: int) -> typing.List[int]:
+        return [self._rng.getrandbits(64) for _ in range(count)]
+
+    # Return the body part keys of kind for lifetimes up to max_lifetime
+    def part_keys(self, kind: int, max_lifetime: int) -> typing.List[typing.List[int]]:
+        parts = self.parts[kind]
+        while len(parts) <= max_lifetime:
+            parts.append(self._new_keys(self.size))
+        return parts
+
+
+@functools.lru_cache(maxsize=None)
+def get_keys(width: int, height: int) -> ZobristKeys:
+    return ZobristKeys(width, height)
+
+
+# Return the Zobrist hash of a board, cached on the board
+def board_hash(board: Board) -> int:
+    if 'hash' in board.cache:
+        return board.cache['hash']
+    keys = get_keys(board.width, board.height)
+    value = 0
+    for cell in board.food_cells:
+        value ^= keys.food[cell]
+    size = board.size
+    for i, body in enumerate(board.bodies):
+        kind = 0 if i == board.you else 1
+        length = len(body)
+        parts = keys.part_keys(kind, length)
+        for j, cell in enumerate(body[:-1]):
+            value ^= parts[length - (j + 1)][cell]
+        # The tail is about to move, or is stacked on the part before it
+        value ^= parts[0][body[-1]]
+        health = min(max(board.healths[i], 0), MAX_HEALTH)
+        value ^= keys.health[kind][health * size + body[0]]
+    board.cache['hash'] = value
+    return value
+
+
+# Dictionary that evicts its least recently used entries once it holds max_entries
+class TranspositionTable:
+    def __init__(self, max_entries: int = TABLE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: typing.Hashable) -> typing.Optional[typing.Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key: typing.Hashable, value: typing.Any):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.entries)